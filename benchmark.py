@@ -0,0 +1,186 @@
+"""Benchmarks for Multimodule.
+Generates synthetic packages, builds them with multimodule.py and compares importing the extension with importing the same package from source.
+Arguments:
+modules:
+A comma seperated list of module counts. Each one is generated, built and measured, so you can see how things scale.
+
+startup:
+Also build each package as an exe, once normally and once with isolated and no_site, and time running it against python -m on the source and python importing the extension. Each package gets a __main__ module that imports all of it's modules.
+
+depth:
+How many levels of nested packages the modules are spread over.
+
+loc:
+Roughly how many lines of code each module has.
+
+fanout:
+How many of the other modules each module imports.
+
+repeat:
+How many times each import is timed. The first run counts as the cold import and the median of the others is the warm one.
+
+output:
+The JSON file the results are written to. Each result has the build time, the time of each build phase taken from multimodule's build trace, the size of the extension, the import time and memory for the extension and the source package, and the extension's per-module importer times. The importer times come from a separate run, so recording them doesn't slow down the timed imports.
+
+Note: The generated packages and builds are put in a temp directory, which is removed unless keep is set.
+"""
+__version__='0.6'
+__author__="Keith"
+
+import os, sys, json, time, random, shutil, subprocess, tempfile, statistics
+from os import path
+
+
+# Run in a fresh interpreter to time importing a list of modules from one location.
+import_driver="""
+import sys, time, json, importlib
+location, names=sys.argv[1], json.loads(sys.argv[2])
+sys.path.insert(0, location)
+try:
+	import resource
+	before=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+except ImportError: resource=None
+start=time.perf_counter()
+for i in names: importlib.import_module(i)
+elapsed=time.perf_counter()-start
+result=dict(seconds=elapsed, modules=len(names))
+if resource is not None:
+	after=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform=="darwin": before, after=before//1024, after//1024 # Bytes rather than KB
+	result.update(maxrss_kb=after, import_rss_kb=after-before)
+main=sys.modules[names[0].split(".")[0]]
+if hasattr(main, "import_times"): result["importer"]=main.import_times()
+print(json.dumps(result))
+"""
+
+
+def generate_package(location, name="synthetic", modules=50, depth=2, loc=100, fanout=3, seed=0):
+	"""Writes a package with the given number of modules spread over depth levels of nested packages.
+	Each module imports fanout of the modules made before it, so there are no import cycles.
+	Returns the names of the modules, in an order they can be imported in."""
+	rnd=random.Random(seed)
+	packages=[name]
+	for i in range(1, depth+1): packages.append(packages[-1]+".level"+str(i))
+	for i in packages:
+		directory=path.join(location, *i.split("."))
+		os.makedirs(directory, exist_ok=True)
+		with open(path.join(directory, "__init__.py"), "w", encoding="UTF-8") as f: f.write('"""Synthetic package '+i+'."""\n')
+	names=[]
+	for i in range(modules):
+		module_name=packages[i%len(packages)]+".module"+str(i)
+		lines=['"""Synthetic module '+str(i)+'."""\n']
+		for j in rnd.sample(names, min(fanout, len(names))): lines.append("import "+j+"\n")
+		lines.append("CONSTANT="+str(i)+"\n\n")
+		count=0
+		while len(lines)<loc:
+			lines.extend(("def function"+str(count)+"(x):\n", "\ttotal=0\n", "\tfor n in range(x):\n", "\t\ttotal+=n*"+str(count+1)+"+CONSTANT\n", "\treturn total\n\n"))
+			count+=1
+		lines.extend(("class Thing"+str(i)+":\n", "\tdef __init__(self, value): self.value=value\n", "\tdef total(self): return function0(self.value) if "+str(count)+" else CONSTANT\n"))
+		with open(path.join(location, *module_name.split("."))+".py", "w", encoding="UTF-8") as f: f.writelines(lines)
+		names.append(module_name)
+	with open(path.join(location, name, "__main__.py"), "w", encoding="UTF-8") as f: f.writelines(["import "+i+"\n" for i in names]) # What python -m and the exe run
+	return names
+
+def run_import_driver(location, names, env=None):
+	# Imports the modules once in a new process, and returns what the driver measured.
+	driver=path.join(location, "..", "import_driver.py")
+	if not path.exists(driver):
+		with open(driver, "w", encoding="UTF-8") as f: f.write(import_driver)
+	result=subprocess.run([sys.executable, "-s", driver, location, json.dumps(names)], capture_output=True, text=True, env=env, cwd=path.dirname(driver))
+	if result.returncode!=0: raise RuntimeError("Importing from "+location+" failed:\n"+result.stderr)
+	return json.loads(result.stdout)
+
+def time_imports(location, names, repeat=5):
+	# Imports the modules in new processes. The first one is cold, and the median of the rest is warm.
+	runs=[run_import_driver(location, names) for i in range(max(repeat, 2))]
+	warm=runs[1:]
+	return dict(cold_seconds=runs[0]["seconds"], warm_seconds=statistics.median(i["seconds"] for i in warm), import_rss_kb=statistics.median(i.get("import_rss_kb", 0) for i in warm), maxrss_kb=statistics.median(i.get("maxrss_kb", 0) for i in warm))
+
+def import_phases(location, names):
+	# Imports the modules once more with the importer's timing turned on, which isn't free, so it's kept out of the times above.
+	return run_import_driver(location, names, dict(os.environ, MULTIMODULE_IMPORTTIME=os.devnull)).get("importer") # Records without printing anything
+
+def time_startup(command, repeat=5, cwd=None):
+	# Runs a command to completion in new processes, and times it like time_imports does.
+	runs=[]
+	for i in range(max(repeat, 2)):
+		start=time.perf_counter()
+		result=subprocess.run(command, capture_output=True, text=True, cwd=cwd)
+		runs.append(time.perf_counter()-start)
+		if result.returncode!=0: raise RuntimeError("Running "+' '.join(command)+" failed:\n"+result.stderr)
+	return dict(cold_seconds=runs[0], warm_seconds=statistics.median(runs[1:]))
+
+def build(source, name, output, build_options=()):
+	# Builds the package with multimodule.py in it's own process, and returns the wall time and the build trace.
+	trace=path.splitext(output)[0]+"_trace.json"
+	command=[sys.executable, path.join(path.dirname(path.abspath(__file__)), "multimodule.py"), "--package", "--no-prompt", "--verbose", "0", "--output", output, "--trace", trace]
+	command.extend(build_options)
+	command.append(name)
+	start=time.perf_counter()
+	result=subprocess.run(command, cwd=source, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+	elapsed=time.perf_counter()-start
+	if result.returncode!=0 or not path.exists(output): raise RuntimeError("Building "+name+" failed:\n"+result.stdout+result.stderr)
+	with open(trace, "r", encoding="UTF-8") as f: events=json.load(f)["traceEvents"]
+	phases={}
+	for i in events:
+		if i["cat"]!="phase": continue
+		phase=phases.setdefault(i["name"], dict(seconds=0.0, cpu_seconds=0.0, child_cpu_seconds=0.0))
+		phase["seconds"]+=i["dur"]/1e6
+		phase["cpu_seconds"]+=i["args"].get("cpu_ms", 0)/1000
+		phase["child_cpu_seconds"]+=i["args"].get("child_cpu_ms", 0)/1000
+	return elapsed, phases
+
+def run_benchmark(work, modules=50, depth=2, loc=100, fanout=3, repeat=5, build_options=(), seed=0, startup=False):
+	"""Generates, builds and measures one synthetic package, and returns the results as a dictionary.
+	If startup is set, it also builds the package as an exe, with and without isolated and no_site, and times running it against python -m."""
+	name="synthetic"+str(modules)
+	source=path.join(work, name+"_src")
+	built=path.join(work, name+"_built")
+	os.makedirs(built, exist_ok=True)
+	names=generate_package(source, name, modules, depth, loc, fanout, seed)
+	output=path.join(built, name+(".pyd" if sys.platform=="win32" else ".so"))
+	build_seconds, phases=build(source, name, output, build_options)
+	imports=[name]+names
+	extension=time_imports(built, imports, repeat)
+	extension["importer"]=import_phases(built, imports)
+	source_imports=time_imports(source, imports, repeat)
+	result=dict(modules=modules, depth=depth, loc=loc, fanout=fanout, build_seconds=build_seconds, phases=phases, extension_bytes=path.getsize(output), source_bytes=sum(path.getsize(path.join(source, *i.split("."))+".py") for i in names), extension=extension, source=source_imports)
+	if startup==True:
+		import sysconfig
+		timings=dict(python_m=time_startup([sys.executable, "-m", name], repeat, source), python_extension=time_startup([sys.executable, "-c", "import "+name+".__main__"], repeat, built))
+		for label, options in (("exe", ["--exe"]), ("exe_isolated_no_site", ["--exe", "--isolated", "--no-site"])):
+			program=path.join(built, name+"_"+label+(sysconfig.get_config_var("EXE") or ""))
+			build(source, name, program, list(build_options)+options)
+			timings[label]=time_startup([program], repeat)
+			timings[label]["bytes"]=path.getsize(program)
+		result["startup"]=timings
+	return result
+
+def main(modules: "A comma seperated list of how many modules to generate, one benchmark is run for each"="10,50", depth: "How many levels of nested packages to use"=2, loc: "Roughly how many lines each module has"=100, fanout: "How many other modules each module imports"=3, repeat: "How many times to time each import"=5, output: "The JSON file to write the results to"="multimodule_benchmark.json", method: "The method to build with"="1", jobs: "How many C files to compile at the same time"=0, keep: "Keep the generated packages and builds"=False, seed: "The random seed for generating the packages"=0, startup: "Also build each package as an exe and compare how long it takes to start with python -m"=False):
+	try: counts=[int(i) for i in str(modules).split(",")]
+	except ValueError: sys.exit("modules should be a comma seperated list of numbers, not "+str(modules))
+	depth, loc, fanout, repeat, jobs, seed=int(depth), int(loc), int(fanout), int(repeat), int(jobs), int(seed)
+	build_options=["--method", str(method), "--jobs", str(jobs)]
+	work=tempfile.mkdtemp(prefix="multimodule_benchmark")
+	results=[]
+	try:
+		for i in counts:
+			print("Benchmarking", i, "modules...")
+			result=run_benchmark(work, i, depth, loc, fanout, repeat, build_options, seed, startup==True)
+			print(f"  build {result['build_seconds']:.2f}s, {result['extension_bytes']} bytes, import {result['extension']['warm_seconds']*1000:.2f}ms (source {result['source']['warm_seconds']*1000:.2f}ms), cold {result['extension']['cold_seconds']*1000:.2f}ms (source {result['source']['cold_seconds']*1000:.2f}ms)")
+			if "startup" in result: print("  start up "+', '.join(f"{k} {v['warm_seconds']*1000:.2f}ms" for k, v in result["startup"].items()))
+			results.append(result)
+	finally:
+		if keep==True: print("The generated packages are in "+work)
+		else: shutil.rmtree(work, ignore_errors=True)
+	try:
+		import Cython
+		cython_version=Cython.__version__
+	except ImportError: cython_version=None
+	with open(output, "w", encoding="UTF-8") as f:
+		json.dump(dict(python=sys.version, platform=sys.platform, cython=cython_version, method=str(method), jobs=jobs, seed=seed, results=results), f, indent=1, sort_keys=True)
+	print("Saved the results to "+output)
+
+if __name__=="__main__":
+	import begin.main
+	begin.main.Program(main).start()
@@ -2,16 +2,20 @@
 Arguments:
 method: (1,2)
 Select which method is used to build the Cython extension.
-If you don't set a value or set it to 1, generate a DLL with one PyInit export symbol for each module, and an importer that activates when you import the main module and allows you to easily import other modules.
+If you don't set a value or set it to 1, generate a DLL with one PyInit function for each module, and an importer that activates when you import the main module and allows you to easily import other modules.
+The importer calls the PyInit functions through a table in the main module, so only the main module's PyInit is exported.
 This method supports .py and .pyx files, and it can handle just about anything that Cython can Cythonize.
 Note that the import symbols are filled in with random letters, to allow multiple modules with similar names.
+Set stable_names to use a hash of each module's full name instead, so that building the same sources twice gives the same C code and the same extension.
 
 
 If you set method to 2, creates a single .pyx file by creating a function for each module. When that module is imported, that function returns locals(), which is dumped into a modules namespace.
-The functions are declared using cdef, so they don't clutter up the namespace and a dictionary is stored mapping module names to there functions.
-This method creates slightly smaller binaries and only exports one function.
+The functions are kept in a tuple and deleted from the main module, so they don't clutter up the namespace, and a dictionary is stored mapping module names to there functions.
+This method only runs Cython and the C compiler once, creates slightly smaller binaries and only exports one function.
 However, it's not as compatable as method 1.
-Most code you can write in pure Python works as far as I know, but Cython, for example, won't let you use cdef to declare functions with method 2, since that would create functions inside functions.
+Most code you can write in pure Python works as far as I know, but Cython, for example, won't let you use cdef to declare functions or classes with method 2, since that would create functions inside functions.
+Modules that use global, import *, or have a .pxd file can't be built either, and the build stops with a list of the lines that caused problems.
+Relative imports are made absolute and cimports are moved to the top of the main module.
 Note: Since this method might be able to turn packages into single.pyx files, you might want to distribute those files if you release code. Only Cython is required to compile those files.
 To do this, compile a package with this tool, then open up the build_temp directory and look for a .pyx file matching the main module. This should be the same name as your package. Copy this file to your package and store it.
 
@@ -33,6 +37,76 @@ A list of comma seperated names, either of files or directories, to include.
 If it's a file, the script will look for a file that has a .py or .pyx extension.
 If it's a directory, the script will treat that directory as a package and try to include anything in it.
 
+lazy_import:
+An alternative to import_all. The main module and every embedded package get a module level __getattr__ and __dir__ (PEP 562), so main.sub.thing imports sub the first time it's used, instead of every module being imported when the extension is.
+A module that defines it's own __getattr__ keeps it.
+
+preload:
+Give the main module a preload(names=None, background=True, progress=None) function, for programs like servers that don't want to wait for an import the first time a rarely used module is needed, but don't want import_all to slow down starting either.
+It imports the named modules (a package includes everything in it), or all of them, in a daemon thread. They're imported after the modules they import, which is worked out when building by reading every module's imports, so it's only done when this is set. It's safe for the program to import the same modules at the same time.
+It returns an object with wait(), done, loaded and failed. progress is called after each module, and without it failures are reported as RuntimeWarnings.
+
+import_profile:
+Record how long each embedded module takes to be found and run, how deeply it was nested and how many times it was looked up.
+The main module gets import_times(), which returns the numbers as a dictionary, and import_report(), which formats them like python -X importtime.
+Setting the MULTIMODULE_IMPORTTIME environment variable turns the recording on even without this option, and prints the report to stderr at exit, or writes it to the file it names (as JSON if the name ends with .json).
+
+cache:
+A directory that keeps the generated C files and object files for each module between builds.
+The files are found again using a hash of the module's source, it's .pxd and .pxi files, the Cython version and the compiler settings, so changing one module only rebuilds that module and relinks.
+Any module can cimport another's .pxd file, so changing a .pxd or .pxi file, or a header in cinclude, rebuilds everything. The cache also names the PyInit symbols like stable_names does, since a new random name for the changed module would change the main module as well.
+
+jobs:
+How many C files are compiled at the same time. Each generated C file is compiled on it's own, and the object files are always linked in the same order.
+
+trace:
+A file to save how long each part of the build took, with the wall time, CPU time and CPU time used by child processes like the C compiler.
+Each module's preprocessing, Cython run and C compile get their own entries with their wall time, including the Cython runs done in worker processes, which also have their CPU time. The CPU times of the build itself and the compiler are only given for whole phases, since the modules are worked on at the same time.
+The file uses the Chrome trace format, so chrome://tracing or https://ui.perfetto.dev can show it, and a summary is printed at the end of the build.
+
+watch:
+Build the extension, then keep running and build it again whenever a module, it's .pxd or .pxi files or the init_code file changes.
+Cython and the compiler stay loaded between builds, and the cache is used (in the temp directory if you don't set one) with stable_names, so only modules that changed are cythonized and compiled again before relinking.
+manifest:
+A JSON or TOML file describing several extensions to build at once. It has an optional options table with settings shared by every target, and a targets table with one table of settings for each target, using the same names as the command line options.
+Each target needs a main_module, and can have a list of files and a directory to build from, which is relative to the manifest and works like the directory option.
+The main module and files given on the command line pick which targets to build, and * builds all of them. Options set on the command line override the shared options, and a target's own settings override both.
+The targets are built at the same time without changing the current directory, and share one pool of jobs for preprocessing and compiling, the Cython worker processes, and compilers that are only set up once. With no_cython_processes, the targets take turns running Cython.
+
+directory:
+Where to look for the modules before sys.path. Relative paths in the other options, like output, build_temp, init_code and the data patterns, are relative to it as well. The default is the current directory.
+
+freeze, freeze_size and freeze_profile:
+Embed some .py modules as marshalled bytecode instead of running them through Cython and the C compiler, which makes the build faster and the extension smaller. The importer runs the bytecode from memory.
+freeze is a comma seperated list of module names, freeze_size freezes every .py module smaller than that many bytes, and freeze_profile is a profile saved by cProfile or pstats, which freezes the modules that took less than 1% of the profiled time.
+Modules that took longer than that in the profile stay compiled, unless freeze names them. .pyx files and modules with a .pxd file always go through Cython.
+The bytecode is compiled with the optimization level of the Python running the build, so use python -O or -OO to leave out asserts or docstrings, and it only loads on the same version of Python.
+
+data:
+A comma seperated list of glob patterns (** works too) for data files to embed in the extension, like templates or tables. Each file belongs to the innermost embedded package whose directory it's in.
+The files are compiled into the extension's read only data, and importlib.resources.files() on the package returns them without touching the file system. Besides the usual Traversable methods, each file has memoryview(), which returns it's contents straight from the extension with no copies, so a big table is only in memory once no matter how many processes load it.
+With cache set, the compiled data files are reused until one of them changes.
+
+pgo:
+A Python script to train a profile guided optimization build with. The C files are compiled and linked three times: normally, with -fprofile-generate, and with -fprofile-use and the profile the script made while it used the instrumented extension.
+The script is run from the build's directory, and the extension being trained comes first on sys.path. The script is timed with the normal and the optimized builds, and the times are printed at the end.
+Works with gcc and clang, through distutils or with ccompiler set to clang. clang's profiles are merged with llvm-profdata, which needs to be on the path. The cache isn't used for PGO builds.
+
+precompiled_header:
+Compile Python.h and the other headers every Cython C file starts with into a precompiled header once per build, and use it for every C file, so the compiler doesn't parse them again for each module.
+This works with gcc and clang, through distutils or with ccompiler set to clang. Other compilers build without one.
+
+exe, isolated and no_site:
+Build an executable instead of an extension. It links the same object files with a small main function that registers the main module's PyInit as a builtin module, starts the interpreter embedded in it and imports the main module, which installs the importer.
+If there's an embedded __main__ module (main.__main__ with package), the exe runs it as __main__ like python -m does. Otherwise a plain main module is run as __main__ itself, and a package is just imported.
+Starting it skips finding and loading the extension from disk. isolated starts the interpreter in isolated mode, and no_site skips importing site, which saves the most time but leaves site-packages off sys.path, so only set it if the program doesn't need anything from there.
+The exe links with the libpython of the Python that built it, and on Windows it needs the Python DLL next to it or on the path.
+
+size_report:
+A JSON file to save a report of what each module adds to the extension, which is also printed as a table, biggest first. For each module it has the source lines, the size of the generated C file and the object file, and what the module put in each kind of section of the linked file, which comes from the linker's map file when linking with gcc or clang on Linux.
+It also counts the calls Cython made into the Python C API and the PyObject temporaries it needed, against the C typed temporaries, which shows which modules would gain the most from typing their variables. Frozen modules are listed with the size of their bytecode.
+If the file already exists, the table shows how much each module has grown or shrunk since that report. With method 2 every module is in the main module's C file, so there is only one row.
+
 Note: The script stores all the left over junk in the build_temp directory. It's safe to delete.
 
 """
@@ -45,6 +119,7 @@ _cached_names={}
 def get_name(loc, name=None):
 	loc=path.abspath(loc)
 	if loc in _cached_names: return _cached_names[loc]
+	original=loc
 	if not name:
 		name=path.split(loc)[1]
 		name=path.splitext(name)[0]
@@ -56,8 +131,7 @@ def get_name(loc, name=None):
 		part=path.sep.join(part)
 		n=part.split(path.sep)[-1]
 		for j in ext:
-			loc=path.join(part, "__init__"+j)
-			if path.exists(loc) and path.isfile(loc):
+			if _file_index.isfile(path.join(part, "__init__"+j)):
 				packages.insert(0, n)
 				break
 		else: break
@@ -66,7 +140,7 @@ def get_name(loc, name=None):
 	if len(packages)<2: return name
 	else:
 		name='.'.join(packages)
-		_cached_names[loc]=name
+		_cached_names[original]=name
 		return name
 
 def eprint(*args, **kwargs): return print(*args, file=sys.stderr, **kwargs)
@@ -74,7 +148,7 @@ def eprint(*args, **kwargs): return print(*args, file=sys.stderr, **kwargs)
 
 class mod:
 	"""A class to hold data about modules"""
-	__slots__=("file", "name", "shortname", "cfile", "pyfile") # The list of attributes that'll be set.
+	__slots__=("file", "name", "shortname", "cfile", "pyfile", "key") # The list of attributes that'll be set.
 
 	def __init__(self, **kwargs):
 		for i in kwargs.keys(): setattr(self, i, kwargs[i])
@@ -85,6 +159,123 @@ class mod:
 		if isinstance(other, str): return self.name==other
 		else: return object.__eq__(self, other)
 
+def get_stable_symbol(name, length=8):
+	# Makes a PyInit symbol from a hash of the module name, so it's the same every time the module is built.
+	import hashlib
+	return "PyInit_"+hashlib.sha256(name.encode("UTF-8")).hexdigest()[:length]
+
+def find_data_files(patterns, modules):
+	"""Finds the data files matching the comma seperated glob patterns, and works out which embedded package each one belongs to.
+	Returns a list of (package name, path inside the package seperated with /, filename)."""
+	import glob
+	packages={}
+	for i in modules:
+		if path.splitext(path.basename(i.file))[0]=="__init__": packages[path.normcase(path.dirname(i.file))]=i.name
+	results=[]
+	seen=set()
+	for pattern in patterns.split(","):
+		pattern=pattern.strip()
+		if not pattern: continue
+		matches=[path.abspath(i) for i in glob.glob(pattern, recursive=True) if path.isfile(i)]
+		if len(matches)==0: eprint("Warning, no data files match "+pattern)
+		for i in sorted(matches):
+			if i in seen or "__pycache__" in i.split(path.sep): continue
+			seen.add(i)
+			directory=path.dirname(i)
+			while not path.normcase(directory) in packages:
+				parent=path.dirname(directory)
+				if parent==directory: die("The data file "+i+" isn't inside any of the embedded packages")
+				directory=parent
+			results.append((packages[path.normcase(directory)], path.relpath(i, directory).replace(path.sep, "/"), i))
+	return results
+
+def write_data_file(filename, files, strings=True):
+	"""Writes a C file that has the contents of each file as a read only array, and tables of pointers to them and their sizes in the same order as files.
+	The arrays end up in the extension's read only data, which the OS maps from the file and shares between processes.
+	If strings is set, the arrays are written as string literals, which compilers read far faster than lists of numbers. MSVC limits how long a string can be, so it needs the lists."""
+	escapes=[chr(i) if 32<=i<127 and not chr(i) in '\\"?' else "\\%03o" % i for i in range(256)] # Always 3 digits, so a digit after one isn't read as part of it
+	with open(filename, "w", encoding="ASCII") as f:
+		f.write('#include "Python.h"\n#if defined(_MSC_VER)\n#define MULTIMODULE_ALIGN __declspec(align(16))\n#else\n#define MULTIMODULE_ALIGN __attribute__((aligned(16)))\n#endif\n')
+		sizes=[]
+		for index, i in index_range(files):
+			with open(i, "rb") as data: raw=data.read()
+			sizes.append(len(raw))
+			if strings==True:
+				f.write("MULTIMODULE_ALIGN static const unsigned char multimodule_data_"+str(index)+"["+str(len(raw)+1)+"]=\n") # With room for the 0 the string ends with
+				for j in range(0, len(raw), 64): f.write('"'+''.join(map(escapes.__getitem__, raw[j:j+64]))+'"\n')
+				if len(raw)==0: f.write('""\n')
+				f.write(";\n")
+				continue
+			f.write("MULTIMODULE_ALIGN static const unsigned char multimodule_data_"+str(index)+"["+str(max(len(raw), 1))+"]={\n")
+			for j in range(0, len(raw), 64): f.write(','.join(map(str, raw[j:j+64]))+",\n")
+			if len(raw)==0: f.write("0\n")
+			f.write("};\n")
+		f.write("const unsigned char *const multimodule_data[]={"+', '.join("multimodule_data_"+str(i) for i in range(len(files)))+"};\n")
+		f.write("const Py_ssize_t multimodule_data_sizes[]={"+', '.join(map(str, sizes))+"};\n")
+
+def get_data_table_code(count):
+	# The declarations the main module needs to make memoryviews of the embedded data files.
+	code=["cdef extern from *:\n\t\"\"\"\n"]
+	if count>0:
+		code.append("extern const unsigned char *const multimodule_data[];\nextern const Py_ssize_t multimodule_data_sizes[];\n")
+		code.append("static PyObject *multimodule_data_view(Py_ssize_t index) {\n\treturn PyMemoryView_FromMemory((char *)multimodule_data[index], multimodule_data_sizes[index], PyBUF_READ);\n}\n")
+	else: code.append("static PyObject *multimodule_data_view(Py_ssize_t index) {\n\tPyErr_SetString(PyExc_FileNotFoundError, \"No data files are embedded\");\n\treturn NULL;\n}\n")
+	code.append("\t\"\"\"\n\tobject multimodule_data_view(Py_ssize_t index)\n")
+	return ''.join(code)
+
+def choose_frozen_modules(modules, names="", size=0, profile="", threshold=0.01):
+	"""Returns the modules that should be embedded as bytecode: the ones named in names, .py files smaller than size bytes and .py files that took less than threshold of the time in a pstats profile.
+	Modules that took longer than that in the profile are only frozen if they're named, and .pyx files and modules with a .pxd file are never frozen."""
+	named=set(i for i in names.split(",") if i) if names else set()
+	hot=set()
+	cold=set()
+	if profile:
+		import pstats
+		try: stats=pstats.Stats(profile).stats
+		except (OSError, TypeError, ValueError) as e: die("Couldn't read the profile "+profile+": "+str(e))
+		times={}
+		for (filename, line, function), (cc, nc, tt, ct, callers) in stats.items():
+			filename=path.normcase(path.abspath(filename)) if not filename.startswith("<") and filename!="~" else filename
+			times[filename]=times.get(filename, 0)+tt
+		total=sum(times.values()) or 1
+		for i in modules:
+			if times.get(path.normcase(i.file), 0)/total>=threshold: hot.add(i.name)
+			else: cold.add(i.name)
+	results=[]
+	for i in modules:
+		if not i.name in named and (i.name in hot or not (i.name in cold or (size>0 and path.getsize(i.file)<size))): continue
+		if path.splitext(i.file)[1]==".pyx" or any(j.endswith(".pxd") for j in companion_files(i)):
+			if i.name in named: eprint("Warning, "+i.name+" needs Cython, so it can't be frozen")
+			continue
+		results.append(i)
+	missing=named.difference(i.name for i in modules)
+	if len(missing)>0: eprint("Warning, these modules were supposed to be frozen, but aren't included: "+', '.join(sorted(missing)))
+	return results
+
+def freeze_module(module, encoding="UTF-8"):
+	# Compiles a module to bytecode with the optimization level the build is running with, and returns it marshalled.
+	import marshal
+	try: code=compile(open_file(module.file, encoding=encoding, split=False), "<frozen "+module.name+">", "exec", dont_inherit=True)
+	except SyntaxError as e: die("Couldn't freeze "+module.name+": "+str(e))
+	return marshal.dumps(code)
+
+def get_package_names(module_names):
+	results=set()
+	for i in module_names:
+		parts=i.split(".")
+		for j in range(1, len(parts)): results.add('.'.join(parts[:j]))
+	return results
+
+def get_module_children(module_names, main_module_name):
+	# Maps each package to {attribute name: module name} for the modules directly inside it. Top level modules count as being inside the main module.
+	results={}
+	for i in sorted(module_names):
+		if i==main_module_name: continue
+		parent, dot, attr=i.rpartition(".")
+		if not parent: parent=main_module_name
+		results.setdefault(parent, {})[attr]=i
+	return results
+
 def get_random_letters(length=30):
 	letters="abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
 	res=""
@@ -93,6 +284,10 @@ def get_random_letters(length=30):
 
 
 embedded_code="""
+if __file__=="built-in": # Linked into an exe, where the spec's origin is built-in
+	import sys
+	__file__=sys.executable
+	del sys
 __path__=(__file__,)
 __package__=__name__
 if '__spec__' in globals(): __spec__.submodule_search_locations=__path__ # This should hopefully allow relative imports.
@@ -114,14 +309,11 @@ cdef class multimodule_importer:
 
 
 	cdef _find_spec(self, str name):
+		cdef bint has_submodules=name in __module_packages__
+		if not has_submodules and not name in __module_dict__ and not name in __frozen_modules__: return None # Most imports aren't ours, so give up on them as quickly as possible.
 		import importlib.machinery, importlib
-		has_submodules=False
 		sp=None
-		for i in __module_dict__:
-			if i.startswith(name+"."):
-				has_submodules=True
-				break
-		if name in __module_dict__:
+		if name in __module_dict__ or name in __frozen_modules__:
 			sp=importlib.machinery.ModuleSpec(name=name, loader=self, origin=self.file, is_package=has_submodules)
 		if sp is None and has_submodules==True:
 			sp=importlib.machinery.ModuleSpec(name=name, loader=None, origin=None, is_package=True)
@@ -132,28 +324,362 @@ cdef class multimodule_importer:
 
 	def find_spec(self, str name, *args, **kwargs):
 		#{protect_find_spec}
+		if __import_profile__: return self._profiled_find_spec(name)
 		return self._find_spec(name)
 
-	def create_module(self, *args, **kwargs): return None
+	cdef _profiled_find_spec(self, str name):
+		from time import perf_counter
+		start=perf_counter()
+		sp=self._find_spec(name)
+		if sp is not None and sp.loader is self:
+			stats=multimodule_import_stats(name)
+			stats["find_spec"]+=perf_counter()-start
+			stats["count"]+=1
+		return sp
+
+	cdef _profiled_exec_module(self, module):
+		from time import perf_counter
+		from threading import get_ident
+		name=module.__name__
+		stack=multimodule_import_stacks.setdefault(get_ident(), [])
+		stats=multimodule_import_stats(name)
+		stats["depth"]=len(stack)
+		stats["parent"]=stack[-1] if len(stack)>0 else None
+		stack.append(name)
+		start=perf_counter()
+		try: self._exec_module(module)
+		finally:
+			elapsed=perf_counter()-start
+			stack.pop()
+			stats["exec"]+=elapsed
+			if stats["parent"] is not None: multimodule_import_stats(stats["parent"])["nested"]+=elapsed
+
+	def create_module(self, spec):
+		# The module made here is the one importlib puts in sys.modules, so circular imports see the same object that exec_module fills in.
+		if spec.name in __frozen_modules__: return None
+		return multimodule_create_module(__module_dict__[spec.name], spec)
+
+	cdef _exec_module(self, module):
+		# Goes by the spec's name rather than __name__, which is __main__ for a module started by run_main.
+		name=module.__spec__.name
+		code=__frozen_modules__.get(name, None)
+		if code is None: multimodule_exec_module(module, __module_dict__[name])
+		else:
+			from marshal import loads
+			exec(loads(code), module.__dict__)
 
 	def exec_module(self, module):
-		import _imp, importlib, importlib.machinery
-		spec=module.__spec__
-		fakespec=importlib.machinery.ModuleSpec(name=__module_dict__[spec.name], origin=spec.origin, loader=None)
-		temp=_imp.create_dynamic(fakespec, fakespec.origin)
-		temp.__spec__=spec
-		temp.__name__=spec.name
-		temp.__package__=temp.__spec__.parent
-		_imp.exec_dynamic(temp)
-		data=temp.__dict__
-		module.__dict__.update(data, **module.__dict__)
-		setattr(module, "__doc__", data.get("__doc__", None))
+		if __import_profile__: self._profiled_exec_module(module)
+		else: self._exec_module(module)
+		if module.__name__ in __module_children__ and not '__getattr__' in module.__dict__:
+			module.__getattr__, module.__dir__=multimodule_lazy_attributes(module.__name__)
+
+	def run_main(self, str name):
+		# Runs the embedded module name as __main__, the way python -m does. Returns False if it isn't embedded.
+		sp=self._find_spec(name)
+		if sp is None or sp.loader is not self: return False
+		import importlib.util, sys
+		module=importlib.util.module_from_spec(sp)
+		module.__name__="__main__"
+		sys.modules["__main__"]=module
+		self.exec_module(module)
+		return True
+
+	def get_resource_reader(self, str fullname):
+		if fullname in __module_data__: return multimodule_resource_reader(fullname)
+		return None
+
+def multimodule_lazy_attributes(str name):
+	# Makes a module level __getattr__ and __dir__ (PEP 562) that import embedded submodules the first time they're used.
+	cdef dict children=__module_children__.get(name, None) or dict()
+	def __getattr__(str attr):
+		if not attr in children: raise AttributeError("module '"+name+"' has no attribute '"+attr+"'")
+		import importlib, sys
+		module=importlib.import_module(children[attr])
+		setattr(sys.modules[name], attr, module)
+		return module
+	def __dir__():
+		import sys
+		return sorted(set(vars(sys.modules[name])).union(children))
+	return __getattr__, __dir__
+
+import io as multimodule_io
+class multimodule_resource_stream(multimodule_io.RawIOBase):
+	# A read only file over the memoryview of an embedded data file, so reading it doesn't copy the whole thing first.
+	def __init__(self, view):
+		self.view=view
+		self.position=0
+
+	def readable(self): return True
+
+	def seekable(self): return True
+
+	def readinto(self, buffer):
+		target=memoryview(buffer).cast("B")
+		data=self.view[self.position:self.position+len(target)]
+		target[:len(data)]=data
+		self.position+=len(data)
+		return len(data)
+
+	def seek(self, offset, whence=0):
+		if whence==1: offset+=self.position
+		elif whence==2: offset+=len(self.view)
+		if offset<0: raise ValueError("negative seek position %d" % offset)
+		self.position=offset
+		return offset
+
+	def tell(self): return self.position
+del multimodule_io
+
+class multimodule_resource:
+	# An embedded data file or directory, which works as an importlib.resources Traversable.
+	def __init__(self, package, name=""):
+		self.package=package
+		self.path=name
+
+	def __repr__(self): return "<embedded resource %s in %s>" % (self.path or ".", self.package)
+
+	@property
+	def name(self): return self.path.rpartition("/")[2]
+
+	def is_file(self): return self.path in __module_data__[self.package]
+
+	def is_dir(self):
+		if self.path=="": return True
+		prefix=self.path+"/"
+		return any(i.startswith(prefix) for i in __module_data__[self.package])
+
+	def iterdir(self):
+		prefix=self.path+"/" if self.path else ""
+		seen=set()
+		for i in __module_data__[self.package]:
+			if not i.startswith(prefix): continue
+			child=i[len(prefix):].partition("/")[0]
+			if child in seen: continue
+			seen.add(child)
+			yield multimodule_resource(self.package, prefix+child)
+
+	def joinpath(self, *parts):
+		names=[i for i in self.path.split("/") if i]
+		for part in parts:
+			for i in str(part).split("/"):
+				if i=="..":
+					if len(names)>0: names.pop()
+				elif i and i!=".": names.append(i)
+		return multimodule_resource(self.package, "/".join(names))
+
+	__truediv__=joinpath
+
+	def memoryview(self):
+		# The contents of the file, straight from the extension's read only data without being copied.
+		index=__module_data__[self.package].get(self.path, None)
+		if index is None: raise FileNotFoundError("%s isn't a file embedded in %s" % (self.path, self.package))
+		return multimodule_data_view(index)
+
+	def read_bytes(self): return self.memoryview().tobytes()
+
+	def read_text(self, encoding="utf-8", errors="strict"):
+		# Through open, so newlines are translated like they are for files on disk.
+		with self.open("r", encoding=encoding, errors=errors) as f: return f.read()
+
+	def open(self, mode="r", *args, **kwargs):
+		import io
+		if not mode in ("r", "rb"): raise ValueError("Embedded data files can only be opened for reading, not with mode %r" % mode)
+		stream=multimodule_resource_stream(self.memoryview())
+		if mode=="rb": return stream
+		return io.TextIOWrapper(io.BufferedReader(stream), *args, **kwargs)
+
+class multimodule_resource_reader:
+	# What the importer's get_resource_reader returns for packages with embedded data.
+	def __init__(self, package): self.package=package
+
+	def files(self): return multimodule_resource(self.package)
+
+	def open_resource(self, resource): return self.files().joinpath(resource).open("rb")
+
+	def resource_path(self, resource): raise FileNotFoundError("%s is embedded in %s, so it isn't a file on disk" % (resource, self.package))
+
+	def is_resource(self, name): return self.files().joinpath(name).is_file()
+
+	def contents(self): return [i.name for i in self.files().iterdir()]
+
+class multimodule_main_loader:
+	# Wraps the main module's own loader, so importlib.resources can find the data embedded for the main module too.
+	def __init__(self, loader): self.loader=loader
+
+	def __getattr__(self, name): return getattr(self.loader, name)
+
+	def get_resource_reader(self, fullname):
+		if fullname in __module_data__: return multimodule_resource_reader(fullname)
+		return self.loader.get_resource_reader(fullname)
+
+if __name__ in __module_data__ and '__spec__' in globals() and __spec__ is not None:
+	__spec__.loader=__loader__=multimodule_main_loader(__spec__.loader)
+
+cdef dict multimodule_import_times=dict()
+cdef dict multimodule_import_stacks=dict()
+
+cdef dict multimodule_import_stats(str name):
+	stats=multimodule_import_times.get(name, None)
+	if stats is None:
+		stats=multimodule_import_times[name]=dict(find_spec=0.0, exec=0.0, nested=0.0, count=0, depth=0, parent=None)
+	return stats
+
+def import_times():
+	# Returns a dictionary mapping each embedded module that has been imported to the time in seconds spent finding it (find_spec), running it (exec), running it without the embedded modules it imported (self), how deeply it was nested, which embedded module imported it and how many times it was looked up.
+	# Only filled in when the extension was built with import_profile or the MULTIMODULE_IMPORTTIME environment variable was set when it was imported.
+	results=dict()
+	for name, stats in multimodule_import_times.items():
+		results[name]=dict(stats, self=stats["exec"]-stats["nested"])
+		del results[name]["nested"]
+	return results
+
+def import_report():
+	# Formats import_times() like python -X importtime, with embedded modules in the order they were first imported.
+	lines=["import time: self [us] | cumulative | find_spec [us] | lookups | imported module"]
+	for name, stats in import_times().items():
+		lines.append("import time: %9d | %10d | %14d | %7d | %s%s" % (stats["self"]*1e6, stats["exec"]*1e6, stats["find_spec"]*1e6, stats["count"], "  "*stats["depth"], name))
+	return "\\n".join(lines)
+
+def multimodule_dump_import_times(str destination):
+	import sys
+	if destination in ("1", "-"):
+		print(import_report(), file=sys.stderr)
 		return
+	with open(destination, "w", encoding="UTF-8") as f:
+		if destination.endswith(".json"):
+			import json
+			json.dump(import_times(), f, indent=1)
+		else: f.write(import_report()+"\\n")
+
+if len(__frozen_modules__)>0:
+	from importlib.util import MAGIC_NUMBER
+	if MAGIC_NUMBER!=__frozen_magic__: raise ImportError("The frozen modules in "+__name__+" were compiled for a different version of Python")
+	del MAGIC_NUMBER
+
+import os
+if os.environ.get("MULTIMODULE_IMPORTTIME"):
+	__import_profile__=True
+	import atexit
+	atexit.register(multimodule_dump_import_times, os.environ["MULTIMODULE_IMPORTTIME"])
+	del atexit
+del os
 
 import sys
 sys.meta_path.insert(0, multimodule_importer())
 del sys
+
+def multimodule_run_main(str name):
+	# Used by the exe to start the program.
+	import sys
+	for i in sys.meta_path:
+		if isinstance(i, multimodule_importer): return i.run_main(name)
+	return False
+"""
+# Added to the importer when preload is set.
+preload_code="""
+class multimodule_preloader:
+	# What preload returns. loaded lists the modules imported so far, and failed maps the ones that couldn't be imported to their exceptions.
+	def __init__(self, tuple names, progress=None):
+		import threading
+		self.names=names
+		self.progress=progress
+		self.loaded=[]
+		self.failed=dict()
+		self.thread=None
+		self.finished=threading.Event()
+
+	def __repr__(self): return "<preload of %d modules, %d loaded, %d failed>" % (len(self.names), len(self.loaded), len(self.failed))
+
+	@property
+	def done(self): return self.finished.is_set()
+
+	def wait(self, timeout=None):
+		# Returns True once every module has been tried.
+		return self.finished.wait(timeout)
+
+	def _report(self, name, error):
+		if self.progress is not None: self.progress(name, len(self.loaded)+len(self.failed), len(self.names), error)
+		elif error is not None:
+			import warnings
+			warnings.warn("Couldn't preload %s: %r" % (name, error), RuntimeWarning)
+
+	def run(self):
+		import importlib
+		retry=[]
+		try:
+			for name in self.names:
+				# importlib's per module locks make a foreground import of the same module wait for this one to finish, or the other way around.
+				try: importlib.import_module(name)
+				except Exception as e:
+					if type(e).__name__=="_DeadlockError": # Another thread is importing a cycle this module is in, so try again once it's done
+						retry.append(name)
+						continue
+					self.failed[name]=e
+					self._report(name, e)
+					continue
+				self.loaded.append(name)
+				self._report(name, None)
+			for name in retry:
+				try: importlib.import_module(name)
+				except Exception as e:
+					self.failed[name]=e
+					self._report(name, e)
+					continue
+				self.loaded.append(name)
+				self._report(name, None)
+		finally: self.finished.set()
+
+def preload(names=None, background=True, progress=None):
+	# Imports embedded modules ahead of time, so the first real import of them is free. names is a module name or a list of them, and a package includes all the modules in it. The default is every embedded module.
+	# The modules are imported after the ones they import, so a background import rarely waits for another module while it holds one's import lock.
+	# progress is called with the module name, how many modules have been tried, how many there are and the exception if it failed. Without it, failures are reported as RuntimeWarnings.
+	# With background, the imports run in a daemon thread and this returns straight away. Either way it returns a multimodule_preloader, which has wait(), done, loaded and failed.
+	# __main__ modules run the program when they're imported, so they're only preloaded when they're named themselves.
+	cdef tuple chosen=tuple(i for i in __module_order__ if i.rpartition(".")[2]!="__main__")
+	if names is not None:
+		if isinstance(names, str): names=(names,)
+		names=tuple(names)
+		for name in names:
+			if not name in __module_dict__ and not name in __frozen_modules__ and not name in __module_packages__: raise ValueError(name+" isn't embedded in "+__name__)
+		prefixes=tuple(i+"." for i in names)
+		chosen=tuple(i for i in __module_order__ if i in names or (i.startswith(prefixes) and i.rpartition(".")[2]!="__main__"))
+	loader=multimodule_preloader(chosen, progress)
+	if background:
+		import threading
+		loader.thread=threading.Thread(target=loader.run, name="multimodule preload", daemon=True)
+		loader.thread.start()
+	else: loader.run()
+	return loader
+"""
+# Calls the PyInit functions of the embedded modules straight from a table of function pointers, doing the same work as _imp.create_dynamic and _imp.exec_dynamic without going through the dynamic loader.
+init_table_code="""
+static PyObject *multimodule_create_module(Py_ssize_t index, PyObject *spec) {
+	PyObject *m=multimodule_inits[index]();
+	if (m==NULL) {
+		if (!PyErr_Occurred()) PyErr_SetString(PyExc_SystemError, "initialization of an embedded module failed without raising an exception");
+		return NULL;
+	}
+	if (PyObject_TypeCheck(m, &PyModuleDef_Type)) return PyModule_FromDefAndSpec((PyModuleDef *)m, spec);
+	return m;
+}
+
+static int multimodule_exec_module(PyObject *module, Py_ssize_t index) {
+	PyModuleDef *def;
+	if (!PyModule_Check(module)) return 0;
+	def=PyModule_GetDef(module);
+	if (def==NULL) {
+		PyErr_Clear();
+		return 0;
+	}
+	if (PyModule_GetState(module)!=NULL) return 0; /* Already initialised */
+	return PyModule_ExecDef(module, def);
+}
+\"\"\"
+	object multimodule_create_module(Py_ssize_t index, object spec)
+	int multimodule_exec_module(object module, Py_ssize_t index) except -1
 """
+
 def global_import(*modules):
 	# This just imports modules and makes them globally available.
 	import importlib
@@ -218,14 +744,64 @@ def index_range(iterator):
 
 
 
+class file_index:
+	"""Remembers the files and folders in each directory, so finding modules takes one os.scandir call per directory instead of a stat call for every possible filename."""
+	__slots__=("directories",)
+
+	def __init__(self): self.directories={}
+
+	def clear(self): self.directories.clear()
+
+	def scan(self, directory):
+		# Returns dicts of the files and folders in a directory, mapping the normalized name to the real one.
+		directory=path.normcase(path.abspath(directory))
+		entries=self.directories.get(directory)
+		if entries is not None: return entries
+		files, dirs={}, {}
+		parent, name=path.split(directory)
+		if parent in self.directories and not name in self.directories[parent][1]: # The parent was already scanned, so we know this doesn't exist.
+			self.directories[directory]=(files, dirs)
+			return files, dirs
+		try:
+			with os.scandir(directory) as scan:
+				for i in scan:
+					try:
+						if i.is_dir(): dirs[path.normcase(i.name)]=i.name
+						elif i.is_file(): files[path.normcase(i.name)]=i.name
+					except OSError: continue
+		except OSError: pass
+		self.directories[directory]=(files, dirs)
+		return files, dirs
+
+	def isfile(self, location):
+		directory, name=path.split(path.abspath(location))
+		return path.normcase(name) in self.scan(directory)[0]
+
+	def isdir(self, location):
+		directory, name=path.split(path.abspath(location))
+		return name!="" and path.normcase(name) in self.scan(directory)[1]
+
+	def find_files(self, location, extensions):
+		# Returns every file under location with one of the extensions, like find_files but from the index.
+		results=[]
+		todo=[path.abspath(location)]
+		while len(todo)>0:
+			directory=todo.pop(0)
+			files, dirs=self.scan(directory)
+			results.extend(path.join(directory, files[i]) for i in sorted(files) if path.splitext(i)[1] in extensions)
+			todo.extend(path.join(directory, dirs[i]) for i in sorted(dirs))
+		return results
+
+_file_index=file_index()
+
 def find_file_in_directories(dirs, filename, exts):
 	for i in dirs:
 		for j in exts:
 			file=path.join(i, filename)+j
-			if path.exists(file): return path.abspath(file)
+			if _file_index.isfile(file): return path.abspath(file)
 			else: file=path.join(i, filename.replace(".", path.sep)+j)
 
-			if path.exists(file): return path.abspath(file)
+			if _file_index.isfile(file): return path.abspath(file)
 
 	return None
 
@@ -234,59 +810,115 @@ def find_file_in_directories(dirs, filename, exts):
 
 
 
-def open_file(filename, encoding="*", skip_unreadable=False, split=True):
-	if not 'chardet' in globals(): import chardet
-	p=None
-	if not path.exists(filename):
-		die("Can't find file "+filename)
+coding_pattern=r"^[ \t\f]*#.*?coding[:=][ \t]*([-\w.]+)" # From PEP 263
 
-	if encoding=="*":
-		p=open(filename, "rb")
-		import chardet
-		d=chardet.UniversalDetector()
-		length=p.seek(0, 2)
-		p.seek(0, 0)
-		while d.done==False and p.tell()<length: d.feed(p.read(50))
-		charencoding=d.close()["encoding"]
-		p=open(filename, mode="r", encoding=charencoding)
-	else: p=open(filename, mode="r", encoding=encoding)
-	try:
-		lines=p.readlines(2)
-		for i in lines:
-			if i.startswith("#") and 'coding' in i:
-				i=i.strip()
-				if i.startswith("-*-") and i.endswith("-*-"):
-					i=i.split("-*- coding: ", 1)[0].strip(" -*-")
-					print("Found encoding "+i, filename)
-					p=open(filename, encoding=i, mode="r")
-					break
-			if i.startswith("#coding="):
-				i=i.split("#coding=", 1)[1].strip()
-				p=open(filename, mode="r", encoding=i)
+def decode_source(raw, filename, encoding="*", skip_unreadable=False):
+	"""Turns the bytes of a source file into text with universal newlines.
+	A BOM or a PEP 263 coding cookie in the first two lines wins, then the encoding argument. ASCII and UTF-8 are checked first when the encoding is "*", and chardet is only used when that fails."""
+	import re, codecs
+	ascii_bytes=bytes(range(128))
+	if raw.startswith(codecs.BOM_UTF8): encoding, raw="UTF-8", raw[len(codecs.BOM_UTF8):]
+	else:
+		for i in raw.split(b"\n", 2)[:2]:
+			match=re.match(coding_pattern.encode("ASCII"), i)
+			if match:
+				encoding=match.group(1).decode("ASCII")
 				break
-		p.seek(0)
-		data=p.read()
-		p.close()
-	except UnicodeDecodeError:
-		if p: p.close()
-		if skip_unreadable==False: die("Can't decode "+filename+" with encoding "+p.encoding)
+			if i.strip() and not i.lstrip().startswith(b"#"): break # The cookie can only be on the second line if the first is a comment or blank
+	try:
+		# Only a shortcut for encodings that decode ASCII bytes as ASCII, UTF-16 for one doesn't.
+		if raw.isascii() and (encoding=="*" or ascii_bytes.decode(encoding, "replace")==ascii_bytes.decode("ASCII")): data=raw.decode("ASCII")
+		elif encoding!="*": data=raw.decode(encoding)
+		else:
+			try: data=raw.decode("UTF-8")
+			except UnicodeDecodeError:
+				try: import chardet
+				except ImportError: die(filename+" isn't ASCII or UTF-8, and chardet isn't installed to guess it's encoding. Install chardet or set the encoding option")
+				encoding=chardet.detect(raw)["encoding"] or "UTF-8"
+				data=raw.decode(encoding)
+	except (UnicodeDecodeError, LookupError):
+		if skip_unreadable==False: die("Can't decode "+filename+" with encoding "+encoding)
 		else: raise
+	if "\r" in data: data=data.replace("\r\n", "\n").replace("\r", "\n")
+	return data
+
+def open_file(filename, encoding="*", skip_unreadable=False, split=True):
+	if not path.isfile(filename):
+		die("Can't find file "+filename)
+	with open(filename, "rb") as f: raw=f.read()
+	data=decode_source(raw, filename, encoding, skip_unreadable)
 	if split==True: data=data.splitlines(True)
 	return data
 
+def preprocess_module(module, filename, encoding="UTF-8"):
+	# Reads a module once, fixes it in memory and writes it to filename in UTF-8.
+	data=fix_module(open_file(module.file, encoding=encoding), module.name)
+	with open(filename, "w", encoding="UTF-8") as f:
+		f.write("#coding: UTF-8\n")
+		f.writelines(data)
+
+
+def companion_files(module, search_for=(".pxd", ".pxi")):
+	# Finds the .pxd and .pxi files that belong to a module.
+	results=[]
+	file, ext=path.splitext(module.file)
+	for j in search_for:
+		filename=path.join(file, j)
+		if not path.exists(filename):
+			filename=path.join(path.dirname(module.file), module.shortname)+j
+		if path.exists(filename): results.append(filename)
+	return results
 
 def add_files(modules, build_temp):
-	search_for=[".pxd", ".pxi"]
 	for i in modules:
-		file, ext=path.splitext(i.file)
-		for j in search_for:
-			filename=path.join(file, j)
-			if not path.exists(filename):
-				filename=path.join(path.dirname(i.file), i.shortname)+j
-			if path.exists(filename):
-				dest=path.join(build_temp, i.name)+j
-				with open(filename, "rb") as f: data=f.read()
-				with open(dest, "wb") as f: f.write(data)
+		for filename in companion_files(i):
+			dest=path.join(build_temp, i.name)+path.splitext(filename)[1]
+			with open(filename, "rb") as f: data=f.read()
+			with open(dest, "wb") as f: f.write(data)
+
+
+class build_cache:
+	"""Keeps generated C files and object files between builds, keyed by a hash of everything that went into making them"""
+	__slots__=("location", "settings")
+
+	def __init__(self, location, *settings):
+		import hashlib
+		self.location=path.abspath(location)
+		if not path.exists(self.location): os.makedirs(self.location)
+		self.settings=hashlib.sha256(repr(settings).encode("UTF-8")).hexdigest()
+
+	def key(self, *parts):
+		import hashlib
+		h=hashlib.sha256(self.settings.encode("UTF-8"))
+		for i in parts:
+			if isinstance(i, str): i=i.encode("UTF-8")
+			h.update(len(i).to_bytes(8, "little"))
+			h.update(i)
+		return h.hexdigest()
+
+	def depend_on(self, *files):
+		# Makes every key depend on what's in these files as well, for files any module could use.
+		self.settings=self.file_key("dependencies", *files)
+
+	def file_key(self, name, *files):
+		contents=[]
+		for i in files:
+			with open(i, "rb") as f: contents.append(f.read())
+		return self.key(name, *contents)
+
+	def get(self, key):
+		# Returns (cfile, object file, PyInit symbol) if everything for this key is cached, otherwise None.
+		base=path.join(self.location, key)
+		if not all(path.exists(base+i) for i in (".c", ".o", ".sym")): return None
+		with open(base+".sym", "r", encoding="UTF-8") as f: symbol=f.read().strip()
+		return base+".c", base+".o", symbol
+
+	def put(self, key, cfile, obj, symbol=''):
+		import shutil
+		base=path.join(self.location, key)
+		shutil.copyfile(cfile, base+".c")
+		shutil.copyfile(obj, base+".o")
+		with open(base+".sym", "w", encoding="UTF-8") as f: f.write(symbol) # Written last, so an entry only counts once it's complete.
 
 
 def add_include_locations(val, func, splitstr=","):
@@ -300,7 +932,7 @@ def add_include_locations(val, func, splitstr=","):
 
 def protect_importer(data, funcname):
 	find_spec="""
-		if not name in __module_dict__: return None
+		if not name in __module_dict__ and not name in __frozen_modules__ and not name in __module_packages__: return None
 		try: val="""+funcname+"""(name)
 		except: val=False
 		if val==False: return None
@@ -310,67 +942,162 @@ def protect_importer(data, funcname):
 
 
 startswith_hints=("from ", "import ", "cimport ")
-def find_imports(file, name, resolve_relative=True):
+import_module_pattern=r"""\b(?:import_module|__import__)\(\s*(['"])([\w.]+)\1"""
+
+def scan_import_statements(data):
+	# Finds import statements in code that the ast module can't parse, like Cython code. Statements that carry on over several lines in brackets or after a backslash are joined back together.
+	statements=[]
+	current=None
+	depth=0
+	for line in data.splitlines():
+		stripped=line.split("#", 1)[0].strip()
+		if current is None:
+			if not stripped.startswith(startswith_hints): continue
+			current=""
+		current+=" "+stripped.rstrip("\\")
+		depth+=stripped.count("(")-stripped.count(")")
+		if depth>0 or stripped.endswith("\\"): continue
+		statements.append(current.replace(" cimport ", " import ").strip())
+		current=None
+		depth=0
+	return statements
+
+def get_import_nodes(data):
+	import ast
+	try: tree=ast.parse(data)
+	except SyntaxError: pass
+	else:
+		nodes=[]
+		modules=[]
+		for i in ast.walk(tree):
+			if isinstance(i, (ast.Import, ast.ImportFrom)): nodes.append(i)
+			elif isinstance(i, ast.Call) and len(i.args)>0 and isinstance(i.args[0], ast.Constant) and isinstance(i.args[0].value, str):
+				func=i.func.attr if isinstance(i.func, ast.Attribute) else getattr(i.func, "id", None)
+				if func in ("import_module", "__import__"): modules.append(i.args[0].value)
+		return nodes, modules
+	# Probably Cython, so only parse the import statements.
+	import re
+	nodes=[]
+	for i in scan_import_statements(data):
+		try: nodes.extend(ast.parse(i).body)
+		except SyntaxError: continue # Most likely a line of text in a docstring that happens to start with from or import
+	return nodes, [i[1] for i in re.findall(import_module_pattern, data)]
+
+_import_cache={}
+def find_imports(module, encoding="UTF-8", cache_dir=None):
+	"""Returns the absolute names of everything a module imports, including the packages the imported modules are in.
+	The results are kept for each version of the file, and are saved in cache_dir if it's set."""
+	import ast, hashlib, json
 	from importlib.util import resolve_name
+	with open(module.file, "rb") as f: raw=f.read()
+	is_package=path.splitext(path.basename(module.file))[0]=="__init__"
+	package=module.name if is_package else module.name.rpartition(".")[0]
+	key=hashlib.sha256(raw+b"\0"+module.name.encode("UTF-8")+b"\0"+package.encode("UTF-8")).hexdigest()
+	if key in _import_cache: return set(_import_cache[key])
+	cache_file=path.join(cache_dir, key+".imports") if cache_dir else None
+	if cache_file and path.exists(cache_file):
+		with open(cache_file, "r", encoding="UTF-8") as f: results=set(json.load(f))
+		_import_cache[key]=results
+		return set(results)
+	data=decode_source(raw, module.file, encoding)
 	results=set()
-	with open(file, mode="r", encoding="UTF-8") as f: data=f.read()
-	data=data.splitlines(False)
-	possible_imports=tuple(i.lstrip(" 	") for i in data if i.lstrip(" 	").startswith(startswith_hints))
-	for i in possible_imports:
-		i=i.replace("cimport", "import")
-		if i.startswith("import"):
-			val=i.split(" ", 1)[1]
-			val=tuple(j.strip() for j in val.split(","))
-			val=tuple(j.split(" ")[0].strip() for j in val)
-			results.update(val)
+	nodes, modules=get_import_nodes(data)
+	for i in nodes:
+		if isinstance(i, ast.Import):
+			results.update(j.name for j in i.names)
 			continue
-		elif i.startswith("from"):
-			val=i.split(" ", 3)
-			source=val[1]
-			val=tuple(source+"."+j.strip().split(" ", 2)[0] for j in val[3].split(", "))
-			results.update(val)
+		if not isinstance(i, ast.ImportFrom): continue
+		try: source=resolve_name("."*i.level+(i.module or ""), package) if i.level>0 else i.module
+		except (ValueError, ImportError): continue
+		results.add(source)
+		results.update(source+"."+j.name for j in i.names if j.name!="*") # Any of these could be submodules
+	for i in modules:
+		try: results.add(resolve_name(i, package) if i.startswith(".") else i)
+		except (ValueError, ImportError): continue
 	for i in tuple(results):
-		if i.count(".")==1: continue
-		lst=i.split(".")
-		while True:
-			del lst[-1]
-			if len(lst)==0: break
-			text='.'.join(lst)
-			if len(text)==0: break
-			results.add(text)
-	if resolve_relative==True:
-		package_name=name.split(".")[:-1]
-		package_name='.'.join(package_name)
-#  print(package_name, results)
-		results={resolve_name(i, package_name) for i in results}
-	return results
-
-
+		parts=i.split(".")
+		for j in range(1, len(parts)): results.add('.'.join(parts[:j]))
+	_import_cache[key]=results
+	if cache_file:
+		with open(cache_file, "w", encoding="UTF-8") as f: json.dump(sorted(results), f)
+	return set(results)
+
+def find_used_modules(main, modules, encoding="UTF-8", cache_dir=None):
+	# Follows the imports from the main module and returns the names of all the modules it can reach.
+	by_name={i.name: i for i in modules}
+	by_name[main.name]=main
+	prefix=main.name+"."
+	reached={main.name}
+	todo=[main]
+	while len(todo)>0:
+		current=todo.pop()
+		for i in find_imports(current, encoding, cache_dir):
+			if not i in by_name: i=prefix+i # Modules that are renamed to live in the main module can still be imported by their old name
+			if i in reached or not i in by_name: continue
+			reached.add(i)
+			todo.append(by_name[i])
+	return reached
+
+
+def get_import_order(modules, main, encoding="UTF-8", cache_dir=None):
+	"""Returns the names of the modules ordered so that each one comes after the package it's in and the modules it imports, as far as import cycles allow.
+	Importing them in this order means each import mostly runs just that module's own code."""
+	by_name={i.name: i for i in modules}
+	prefix=main.name+"."
+	def dependencies(name):
+		results=set()
+		for i in find_imports(by_name[name], encoding, cache_dir):
+			if not i in by_name: i=prefix+i # Like find_used_modules
+			if i in by_name and i!=name: results.add(i)
+		parent=name.rpartition(".")[0]
+		if parent in by_name: results.add(parent)
+		return sorted(results)
+	order=[]
+	seen=set()
+	for root in sorted(by_name):
+		if root in seen: continue
+		seen.add(root)
+		stack=[(root, iter(dependencies(root)))] # Not recursive, so long chains of imports don't hit the recursion limit
+		while len(stack)>0:
+			name, todo=stack[-1]
+			for i in todo:
+				if i in seen: continue
+				seen.add(i)
+				stack.append((i, iter(dependencies(i))))
+				break
+			else:
+				stack.pop()
+				order.append(name)
+	return order
 
-def locate_modules(files, ext=(".pyx", ".py", ".pyw")):
+_located_modules={}
+def locate_modules(files, ext=(".pyx", ".py", ".pyw"), directory="."):
 	if isinstance(files, str): files=(files,)
+	directory=path.abspath(directory)
+	key=(tuple(files), tuple(ext), directory) # Searching sys.path is slow, so watch mode only does it again when a directory changes.
+	if key in _located_modules: return list(_located_modules[key])
 	f=[]
 	dirs=[]
-	dir_locations=["."]
+	dir_locations=[directory]
 	dir_locations.extend(sys.path)
-	current_files=glob("*.*")
 	for i in tuple(files):
 		result=find_file_in_directories(dir_locations, i, ext)
 		if result is not None:
 			f.append(result)
 			continue
-		if path.exists(i) and path.isfile(i):
-			f.append(i)
+		if _file_index.isfile(path.join(directory, i)):
+			f.append(path.join(directory, i))
 			continue
-		possible_dirs=tuple(path.join(j, i) for j in dir_locations if path.exists(path.join(j, i)) and path.isdir(path.join(j, i)))
+		possible_dirs=tuple(path.join(j, i) for j in dir_locations if _file_index.isdir(path.join(j, i)))
 		if len(possible_dirs)>0:
 			loc=possible_dirs[0]
-			if path.exists(loc) and path.isdir(loc):
-				results=find_files(loc, extensions=ext)
+			if _file_index.isdir(loc):
+				results=_file_index.find_files(loc, ext)
 				if len(files)>0:
 					f.extend(results)
 				continue
 		die("Failed to find "+i)
+	_located_modules[key]=tuple(f)
 	return f
 
 
@@ -432,27 +1159,582 @@ class clang_compiler:
 	add_include_dir=lambda self, dir: self.include_dirs.append(dir)
 	add_library_dir=lambda self, dir: self.lib_dirs.append(dir)
 
-	def compile(self, cfiles, extra_postargs=''):
-		results=[]
-		import subprocess, os.path as path
+	def flags(self, macros=None):
+		import sys
 		cincludes=''
 		for i in self.include_dirs:
 			cincludes+=f"-I{i} "
+		for name, value in macros or ():
+			cincludes+=f"-D{name} " if value is None else f"-D{name}={value} "
+		if sys.platform!="win32": cincludes+="-fPIC "
+		return cincludes
+
+	def compile(self, cfiles, macros=None, extra_postargs='', output_dir=None):
+		results=[]
+		import subprocess, sys, os.path as path
+		if not isinstance(extra_postargs, str): extra_postargs=' '.join(extra_postargs)
+		cincludes=self.flags(macros)
 		for i in cfiles:
 			output_name=path.splitext(i)[0]+".o"
+			if output_dir: output_name=path.join(output_dir, path.basename(output_name))
 			result=subprocess.run(f"{self.exe} -o{output_name} -O3 -w {cincludes} {i} -c {extra_postargs}", shell=True)
 			if result.returncode!=0: raise Exception("Couldn't compile "+i)
 			results.append(output_name)
 		return results
 
+	def precompile_header(self, header, extra_postargs=''):
+		# Compiles header with the same flags as compile. clang uses header.pch for -include header when it's there.
+		import subprocess
+		if not isinstance(extra_postargs, str): extra_postargs=' '.join(extra_postargs)
+		result=subprocess.run(f"{self.exe} -x c-header -o{header}.pch -O3 -w {self.flags()} {header} {extra_postargs}", shell=True)
+		if result.returncode!=0: raise Exception("Couldn't precompile "+header)
+		return header+".pch"
+
 	def link_shared_object(self, objects, output_name, export_symbols=(), extra_postargs=''):
 		import subprocess
+		if not isinstance(extra_postargs, str): extra_postargs=' '.join(extra_postargs)
 		objs=' '.join(objects)
 		libs=''
 		for i in self.lib_dirs: libs+="-L"+i+" "
 		res=subprocess.run(f"{self.exe} {libs} -o{output_name} -shared {objs} {extra_postargs}", shell=True)
 		if res.returncode!=0: raise Exception("Failed to compile object files"+objs)
 
+	def link_executable(self, objects, output_progname, libraries=(), library_dirs=(), runtime_library_dirs=(), extra_postargs=''):
+		import subprocess
+		if not isinstance(extra_postargs, str): extra_postargs=' '.join(extra_postargs)
+		objs=' '.join(objects)
+		libs=''
+		for i in tuple(self.lib_dirs)+tuple(library_dirs or ()): libs+="-L"+i+" "
+		for i in runtime_library_dirs or (): libs+="-Wl,-rpath,"+i+" "
+		for i in libraries or (): libs+="-l"+i+" "
+		res=subprocess.run(f"{self.exe} -o{output_progname}{self.exe_ext or ''} {objs} {libs} {extra_postargs}", shell=True)
+		if res.returncode!=0: raise Exception("Failed to link the executable "+output_progname)
+
+def setup_compiler(cmd, ccompiler, verbose):
+	#This modified code snippet was taken from distutils.command.build_ext.run
+	from distutils.ccompiler import new_compiler
+	from distutils.command.build_ext import customize_compiler
+	if not ccompiler: ccompiler=cmd.compiler
+	com=new_compiler(compiler=ccompiler, verbose=verbose>=3)
+	customize_compiler(com)
+	if cmd.include_dirs is not None:
+		com.set_include_dirs(cmd.include_dirs)
+	if cmd.define is not None:
+		for (name, value) in cmd.define:
+			com.define_macro(name, value)
+	if cmd.undef is not None:
+		for macro in cmd.undef:
+			com.undefine_macro(macro)
+	if cmd.libraries is not None:
+		com.set_libraries(cmd.libraries)
+	if cmd.library_dirs is not None:
+		com.set_library_dirs(cmd.library_dirs)
+	if cmd.rpath is not None:
+		com.set_runtime_library_dirs(cmd.rpath)
+	if cmd.link_objects is not None:
+		com.set_link_objects(cmd.link_objects)
+	return com
+
+def make_compiler(ccompiler="", cinclude="", verbose=2):
+	# Sets up the C compiler with Python's include and library directories, like build_ext does.
+	from distutils.command.build_ext import build_ext
+	from distutils.dist import Distribution
+	cmd=build_ext(Distribution())
+	cmd.finalize_options()
+	if ccompiler=="clang":
+		com=clang_compiler()
+		for i in cmd.include_dirs: com.add_include_dir(i)
+		for i in cmd.library_dirs: com.add_library_dir(i)
+	else: com=setup_compiler(cmd, ccompiler, verbose)
+	add_include_locations(cinclude, com.add_include_dir)
+	return com
+
+# What every Cython C file includes before any code of it's own.
+precompiled_header_code="""#ifndef PY_SSIZE_T_CLEAN
+#define PY_SSIZE_T_CLEAN
+#endif
+#include "Python.h"
+#include "compile.h"
+#include "frameobject.h"
+#include "traceback.h"
+#include <stddef.h>
+#include <stdint.h>
+#include <math.h>
+#include <stdlib.h>
+#include <string.h>
+"""
+
+def compiler_is_clang(com):
+	if isinstance(com, clang_compiler): return True
+	return any("clang" in path.basename(i) for i in (getattr(com, "compiler_so", None) or ())[:2])
+
+def pgo_instrument_args(com, profile_dir):
+	# The args that make the compiler and the linker build an extension that writes profiles to profile_dir.
+	if not isinstance(com, clang_compiler) and getattr(com, "compiler_type", None)!="unix": die("Profile guided optimization only works with gcc and clang")
+	return ["-fprofile-generate="+profile_dir]
+
+def pgo_use_args(com, profile_dir):
+	"""Returns the compile args that use the profiles the training runs wrote to profile_dir.
+	gcc reads it's .gcda files straight from the directory, as long as the object files are compiled to the same place, but clang's .profraw files are merged with llvm-profdata first."""
+	import glob, shutil, subprocess
+	if not compiler_is_clang(com):
+		# Depending on the version, gcc mangles the object's path into the file name or makes the directories.
+		if len(glob.glob(path.join(profile_dir, "**", "*.gcda"), recursive=True))==0: die("The training script didn't write any profiles to "+profile_dir+", make sure it imports the extension")
+		return ["-fprofile-use="+profile_dir, "-fprofile-correction", "-Wno-missing-profile"]
+	raws=glob.glob(path.join(profile_dir, "*.profraw"))
+	if len(raws)==0: die("The training script didn't write any profiles to "+profile_dir+", make sure it imports the extension")
+	tool=shutil.which("llvm-profdata")
+	if tool is None and sys.platform=="darwin":
+		result=subprocess.run(["xcrun", "-f", "llvm-profdata"], capture_output=True, text=True)
+		if result.returncode==0: tool=result.stdout.strip()
+	if not tool: die("Couldn't find llvm-profdata to merge clang's profiles, try putting it on the path environment variable.")
+	merged=path.join(profile_dir, "merged.profdata")
+	if subprocess.run([tool, "merge", "-output="+merged]+raws).returncode!=0: die("llvm-profdata couldn't merge the profiles in "+profile_dir)
+	return ["-fprofile-use="+merged]
+
+def run_training(script, extension_dir, cwd):
+	# Runs the training script with extension_dir at the start of sys.path, and returns how many seconds it took.
+	import subprocess, time
+	bootstrap="import sys, runpy; sys.path.insert(0, sys.argv[1]); sys.argv=sys.argv[2:]; runpy.run_path(sys.argv[0], run_name='__main__')"
+	start=time.perf_counter()
+	result=subprocess.run([sys.executable, "-c", bootstrap, extension_dir, script], cwd=cwd)
+	elapsed=time.perf_counter()-start
+	if result.returncode!=0: die("The training script "+script+" failed with exit code "+str(result.returncode))
+	return elapsed
+
+def make_precompiled_header(com, build_temp, extra_compile_args=()):
+	"""Precompiles the headers every Cython C file includes into build_temp, using the same flags the C files are compiled with.
+	Returns the extra compile args that make the compiler use it, or an empty list if the compiler can't do precompiled headers."""
+	header=path.join(build_temp, "multimodule_pch.h")
+	with open(header, "w", encoding="UTF-8") as f: f.write(precompiled_header_code)
+	try:
+		if isinstance(com, clang_compiler): com.precompile_header(header, extra_compile_args)
+		elif getattr(com, "compiler_type", None)=="unix":
+			from distutils.ccompiler import gen_preprocess_options
+			# gcc looks for header.gch and clang for header.pch when a file is compiled with -include header.
+			com.spawn(com.compiler_so+gen_preprocess_options(com.macros, com.include_dirs)+["-x", "c-header", header, "-o", header+(".pch" if compiler_is_clang(com) else ".gch")]+list(extra_compile_args))
+		else:
+			eprint("Precompiled headers only work with gcc and clang, so the C files will be compiled without one")
+			return []
+	except Exception as e:
+		eprint("Couldn't make a precompiled header, so the C files will be compiled without one: "+str(e))
+		return []
+	return ["-include", header, "-Winvalid-pch"]
+
+# The program the exe option builds. It registers the main module's PyInit as a builtin module, starts an embedded interpreter and runs the main module.
+# The MULTIMODULE_ macros are defined in front of it by write_exe_main.
+exe_main_code="""
+PyMODINIT_FUNC MULTIMODULE_INIT(void);
+
+static int multimodule_start(void) {
+	PyObject *module;
+#ifdef MULTIMODULE_RUN_MAIN
+	PyObject *result;
+	module=PyImport_ImportModule(MULTIMODULE_NAME);
+	if (module==NULL) return -1;
+	result=PyObject_CallMethod(module, "multimodule_run_main", "s", MULTIMODULE_RUN_MAIN);
+	Py_DECREF(module);
+	if (result==NULL) return -1;
+	Py_DECREF(result);
+#else
+	/* When the main module is run as __main__, like python script.py does, it replaces the module Python starts with. */
+	if (strcmp(MULTIMODULE_INITTAB_NAME, "__main__")==0 && PyDict_DelItemString(PyImport_GetModuleDict(), "__main__")==-1) PyErr_Clear();
+	module=PyImport_ImportModule(MULTIMODULE_INITTAB_NAME);
+	if (module==NULL) return -1;
+	Py_DECREF(module);
+#endif
+	return 0;
+}
+
+int main(int argc, char **argv) {
+	PyStatus status;
+	PyConfig config;
+	int code=0;
+	if (PyImport_AppendInittab(MULTIMODULE_INITTAB_NAME, MULTIMODULE_INIT)==-1) {
+		fprintf(stderr, "Couldn't add %s to the builtin modules\\n", MULTIMODULE_NAME);
+		return 1;
+	}
+#if MULTIMODULE_ISOLATED
+	PyConfig_InitIsolatedConfig(&config);
+#else
+	PyConfig_InitPythonConfig(&config);
+#endif
+	config.parse_argv=0; /* The arguments belong to the program, not the interpreter */
+	config.site_import=MULTIMODULE_SITE;
+	status=PyConfig_SetBytesArgv(&config, argc, argv);
+	if (PyStatus_Exception(status)) goto fail;
+	status=Py_InitializeFromConfig(&config);
+	if (PyStatus_Exception(status)) goto fail;
+	PyConfig_Clear(&config);
+	if (multimodule_start()==-1) {
+		PyErr_Print(); /* Exits with the right code for SystemExit */
+		code=1;
+	}
+	if (Py_FinalizeEx()<0) code=120;
+	return code;
+fail:
+	PyConfig_Clear(&config);
+	Py_ExitStatusException(status);
+}
+"""
+
+def write_exe_main(filename, init_name, main_name, run_main=None, isolated=False, site=True):
+	# Writes the C file with the exe's main function. run_main is the embedded module to run as __main__, or main_name to run the main module itself as __main__. If it's None, the main module is just imported.
+	import json # Module names make valid C strings when JSON quotes them
+	with open(filename, "w", encoding="UTF-8") as f:
+		f.write("#define PY_SSIZE_T_CLEAN\n#include <Python.h>\n")
+		f.write("#define MULTIMODULE_INIT "+init_name+"\n")
+		f.write("#define MULTIMODULE_NAME "+json.dumps(main_name)+"\n")
+		f.write("#define MULTIMODULE_INITTAB_NAME "+json.dumps("__main__" if run_main==main_name else main_name)+"\n")
+		if run_main and run_main!=main_name: f.write("#define MULTIMODULE_RUN_MAIN "+json.dumps(run_main)+"\n")
+		f.write("#define MULTIMODULE_ISOLATED "+str(int(isolated))+"\n#define MULTIMODULE_SITE "+str(int(site))+"\n")
+		f.write(exe_main_code)
+
+def get_python_link_args():
+	"""Returns the libraries, library directories, runtime library directories and extra args for linking a program that embeds this Python, like python3-config --embed --ldflags."""
+	import sysconfig
+	if sys.platform=="win32": return ["python%d%d" % sys.version_info[:2]], [path.join(sys.base_prefix, "libs")], [], []
+	var=lambda name: sysconfig.get_config_var(name) or ""
+	libdir=var("LIBDIR")
+	dirs=[i for i in (var("LIBPL"), libdir) if i]
+	args=var("LIBS").split()+var("SYSLIBS").split()
+	rpath=[]
+	if var("Py_ENABLE_SHARED"): rpath.append(libdir) # So the program finds libpython without LD_LIBRARY_PATH
+	elif sys.platform.startswith("linux"): args.extend(var("LINKFORSHARED").split()) # Exports the interpreter's symbols to the extensions the program imports
+	return ["python"+var("LDVERSION")], dirs, rpath, args
+
+class build_pool:
+	"""The things builds running at the same time share: one pool of threads for preprocessing and compiling, the Cython worker processes, the compilers that have been set up, and a lock for running Cython in this process.
+	Builds only use absolute paths, so they never need the current directory, except for Cython in this process, which keeps it's options in globals as well."""
+	__slots__=("threads", "processes", "compilers", "lock")
+
+	def __init__(self, jobs=0):
+		import threading
+		from concurrent.futures import ThreadPoolExecutor
+		self.threads=ThreadPoolExecutor(max_workers=jobs if jobs>0 else (os.cpu_count() or 1))
+		self.processes=None
+		self.compilers={}
+		self.lock=threading.Lock()
+		_open_pools.append(self)
+
+	def compiler(self, key, setup):
+		# Each compiler is only set up once, even when several builds ask for it at the same time.
+		with self.lock:
+			if not key in self.compilers: self.compilers[key]=setup()
+			return self.compilers[key]
+
+	def cython_processes(self):
+		# The processes that run Cython, started the first time they're needed so builds that are all cached don't pay for them.
+		if self.processes is None:
+			import multiprocessing
+			from concurrent.futures import ProcessPoolExecutor
+			# Spawned rather than forked, since forking copies the compiler threads' locks while they might be held.
+			self.processes=ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"), initializer=init_cython_worker)
+		return self.processes
+
+	def close(self):
+		if self in _open_pools: _open_pools.remove(self)
+		self.threads.shutdown(cancel_futures=True)
+		if self.processes is not None: self.processes.shutdown(cancel_futures=True)
+
+_open_pools=[] # Closed when a build fails, so the worker processes don't outlive it.
+
+_cython_defaults=None # Cython's own options in a worker process, before any build changed them.
+def init_cython_worker():
+	# Runs once in each worker process, so Cython is only imported once per process.
+	import copy, types
+	global _cython_defaults
+	from Cython.Compiler import Options
+	_cython_defaults={i: copy.copy(j) for i, j in vars(Options).items() if not i.startswith("_") and not callable(j) and not isinstance(j, types.ModuleType)}
+
+def cythonize_in_worker(directory, filename, options, directives, quiet=False):
+	"""Cythonizes one file in a worker process, with Cython's options reset to their defaults and then set to options, since workers can be shared by different builds.
+	Returns the extensions cythonize made, and the start time, wall time and CPU time for the build trace."""
+	import os, copy, time
+	from Cython.Build import cythonize
+	from Cython.Compiler import Options
+	if _cython_defaults is None: init_cython_worker()
+	for i, j in _cython_defaults.items(): setattr(Options, i, copy.copy(j))
+	for i, j in options.items(): setattr(Options, i, j)
+	os.chdir(directory)
+	start, cpu=time.perf_counter(), time.process_time()
+	results=cythonize([filename], language_level="3", compiler_directives=directives, quiet=quiet)
+	return results, start, time.perf_counter()-start, time.process_time()-cpu
+
+_shared_build=None # The build_pool used by every target while a manifest is being built.
+
+def compile_c_files(com, cfiles, jobs=0, macros=None, trace=None, pool=None, **kwargs):
+	"""Compiles each C file on it's own using a pool of threads, since the compiler runs in it's own process anyway.
+	macros can map C files to a list of (name, value) macros that are only defined for that file.
+	If pool is an executor, the files are compiled with it instead of a new pool, so several builds can share it.
+	Returns the object files in the same order as cfiles, and a list of (cfile, exception) for the files that failed."""
+	from concurrent.futures import ThreadPoolExecutor
+	if jobs<1: jobs=os.cpu_count() or 1
+	if macros is None: macros={}
+	failed=[]
+	if trace is None: trace=build_trace()
+	def compile_one(cfile):
+		try:
+			with trace.phase("compile "+path.basename(cfile), "compile", file=cfile): return com.compile([cfile], macros=macros.get(cfile), **kwargs)[0]
+		except Exception as e: failed.append((cfile, e))
+	if len(cfiles)==0: return [], failed
+	if pool is not None: return list(pool.map(compile_one, cfiles)), failed
+	with ThreadPoolExecutor(max_workers=min(jobs, len(cfiles))) as pool:
+		objs=list(pool.map(compile_one, cfiles))
+	return objs, failed
+
+# With method 2, each module is a function in the main module that returns it's locals(), and this code fills in the module from them.
+unity_module_code="""
+cdef object multimodule_create_module(Py_ssize_t index, object spec): return None
+
+cdef int multimodule_exec_module(object module, Py_ssize_t index) except -1:
+	func=multimodule_functions[index]
+	namespace=func(module.__name__, module.__spec__.origin, module.__package__, module.__spec__, module.__loader__)
+	prefix=func.__name__+".<locals>."
+	for value in namespace.values():
+		# Classes and functions think they were made inside func, so make them belong to the module instead.
+		for i in (value,)+tuple(vars(value).values() if isinstance(value, type) else ()):
+			qualname=getattr(i, "__qualname__", None)
+			if not isinstance(qualname, str) or not qualname.startswith(prefix): continue
+			try:
+				i.__qualname__=qualname[len(prefix):]
+				i.__module__=module.__name__
+			except (AttributeError, TypeError): pass
+	module.__dict__.update(namespace)
+	if func.__doc__ is not None: module.__doc__=func.__doc__
+	return 0
+"""
+unity_unsupported=("cdef class ", "cdef extern ", "cdef struct ", "cdef union ", "cdef enum ", "cdef cppclass ", "cdef packed ", "cdef public ", "cdef api ", "cdef inline ", "cpdef ", "ctypedef ", "include ", "DEF ", "IF ")
+
+def get_string_rows(lines):
+	# Returns the indexes of the lines that are inside a string that goes over several lines, or None if the code can't be tokenized.
+	import tokenize, io
+	rows=set()
+	# From Python 3.12, f-strings are split into a start, the parts in between and an end, and they can be nested.
+	opening={getattr(tokenize, i) for i in ("FSTRING_START", "TSTRING_START") if hasattr(tokenize, i)}
+	closing={getattr(tokenize, i) for i in ("FSTRING_END", "TSTRING_END") if hasattr(tokenize, i)}
+	starts=[]
+	try:
+		for i in tokenize.generate_tokens(io.StringIO(''.join(lines)).readline):
+			if i.type==tokenize.STRING and i.end[0]>i.start[0]: rows.update(range(i.start[0], i.end[0]))
+			elif i.type in opening: starts.append(i.start[0])
+			elif i.type in closing:
+				start=starts.pop()
+				if i.end[0]>start: rows.update(range(start, i.end[0]))
+	except (tokenize.TokenError, SyntaxError): return None
+	return rows
+
+def write_unity_modules(p, modules, encoding):
+	"""Writes every module into the main module as a function for method 2.
+	cimports are moved out of the functions, and anything that can't work inside a function stops the build with a list of what went wrong."""
+	import re
+	from importlib.util import resolve_name
+	problems=[]
+	cimports=[]
+	functions=[]
+	for index, i in index_range(modules):
+		is_package=path.splitext(path.basename(i.file))[0]=="__init__"
+		package=i.name if is_package else i.name.rpartition(".")[0]
+		if any(j.endswith(".pxd") for j in companion_files(i)): problems.append(i.name+": it has a .pxd file, which can only be used by it's own extension module")
+		lines=fix_module(open_file(i.file, encoding=encoding), i.name)
+		string_rows=get_string_rows(lines)
+		if string_rows is None:
+			eprint("Warning, couldn't tokenize "+i.file+", so multi-line strings in it might be indented by mistake")
+			string_rows=set()
+		body=[]
+		for number, line in index_range(lines):
+			if number in string_rows:
+				body.append(line)
+				continue
+			relative=re.match(r"(\s*from\s+)(\.+[\w.]*)(\s+c?import\b.*)", line, re.S)
+			if relative:
+				# Relative imports would be worked out from the main module's package, so make them absolute.
+				try: line=relative.group(1)+resolve_name(relative.group(2), package)+relative.group(3)
+				except (ValueError, ImportError): problems.append(i.name+", line "+str(number+1)+": the relative import goes outside of the top level package")
+			code=line.split("#", 1)[0].strip()
+			top_level=not line[:1].isspace()
+			if top_level and (code.startswith(unity_unsupported) or code.startswith("cdef ") and code.endswith(":")):
+				problems.append(i.name+", line "+str(number+1)+": C level functions and types can't be put inside a function")
+			elif code.startswith("global "):
+				problems.append(i.name+", line "+str(number+1)+": global would refer to the main module instead of "+i.name)
+			elif re.match(r"from\s+\S+\s+c?import\s+\*", code):
+				problems.append(i.name+", line "+str(number+1)+": import * isn't allowed inside a function")
+			elif top_level and re.match(r"(from\s+\S+\s+cimport\s|cimport\s)", code):
+				cimports.append(line.rstrip("\n")+"\n")
+				line="\n"
+			body.append(" "+line if line.strip() else line)
+		if len(body)>0 and not body[-1].endswith("\n"): body[-1]+="\n"
+		functions.append(body)
+	if len(problems)>0: die("Method 2 can't build these modules:\n"+"\n".join(problems))
+	p.writelines(cimports)
+	for index, body in index_range(functions):
+		p.write("def multimodule_module_"+str(index)+"(__name__, __file__, __package__, __spec__, __loader__):\n")
+		p.writelines(body)
+		p.write(" pass\n return locals()\n\n")
+	names=["multimodule_module_"+str(i) for i in range(len(functions))]
+	p.write("cdef tuple multimodule_functions=("+''.join(i+", " for i in names)+")\n")
+	if len(names)>0: p.write("del "+', '.join(names)+"\n\n")
+
+# Cython marks the parts of the C files it writes. A module's own code is between these two, and the rest is much the same for every module.
+generated_code_sections=("/* #### Code section: module_code ### */", "/* #### Code section: pystring_table ### */")
+python_api_pattern=r"\b(?:_?Py[A-Z_]\w*|__Pyx_\w+)\s*\("
+temporary_pattern=r"^[ \t]+(?!return\b|else\b|case\b)([A-Za-z_][\w ]*?)[ \t]*(\*?)[ \t]*__pyx_t_\d+\b[^;(]*;"
+section_kinds=(("text", (".text", ".init", ".fini", ".plt")), ("rodata", (".rodata", ".data.rel.ro", ".eh_frame", ".gcc_except_table")), ("data", (".data", ".got", ".init_array", ".fini_array", ".tm_clone_table")), ("bss", (".bss", ".tbss")), ("debug", (".debug", ".comment", ".note", ".stab")))
+
+def count_generated_code(cfile):
+	"""Counts the calls Cython made into the Python C API (with it's own helpers for it and reference counting), and the PyObject and C typed temporaries it used, for a module's C file.
+	Only the module's own code is counted, not the utility code that's in every C file."""
+	import re
+	with open(cfile, "r", encoding="UTF-8", errors="replace") as f: code=f.read()
+	start, end=code.find(generated_code_sections[0]), code.find(generated_code_sections[1])
+	if start>=0 and end>start: code=code[start:end] # Older versions of Cython don't mark the sections, so all of it is counted
+	object_temps=c_temps=0
+	for kind, pointer in re.findall(temporary_pattern, code, re.M):
+		if kind=="PyObject" and pointer: object_temps+=1
+		else: c_temps+=1
+	return dict(python_api_calls=len(re.findall(python_api_pattern, code)), object_temps=object_temps, c_temps=c_temps)
+
+def read_link_map(filename):
+	"""Returns how many bytes each object file put in each kind of section of the linked file, from a GNU ld or lld map file.
+	The kinds are text, rodata, data, bss, debug and other, and the object files are absolute paths."""
+	import re
+	gnu=re.compile(r"^ (\.\S+)?\s+0x[0-9a-fA-F]+\s+0x([0-9a-fA-F]+)\s+(.+\.o(?:bj)?)\s*$")
+	lld=re.compile(r"^\s*[0-9a-fA-F]+\s+[0-9a-fA-F]+\s+([0-9a-fA-F]+)\s+\d+\s+(.+\.o(?:bj)?):\((\S+)\)\s*$")
+	results={}
+	section=None
+	started=False # GNU ld lists the discarded sections first
+	with open(filename, "r", encoding="UTF-8", errors="replace") as f:
+		for line in f:
+			if not started:
+				started=line.startswith("Linker script and memory map") or line.split()[:2]==["VMA", "LMA"]
+				continue
+			match=gnu.match(line)
+			if match: name, size, obj=match.group(1) or section, match.group(2), match.group(3)
+			else:
+				match=lld.match(line)
+				if match is None:
+					if line.startswith(" .") and len(line.split())==1: section=line.strip() # GNU ld puts long section names on a line of their own
+					continue
+				size, obj, name=match.groups()
+			section=name
+			if not name or int(size, 16)==0: continue
+			for kind, prefixes in section_kinds:
+				if name.startswith(prefixes): break
+			else: kind="other"
+			sizes=results.setdefault(path.normcase(path.abspath(obj)), {})
+			sizes[kind]=sizes.get(kind, 0)+int(size, 16)
+	return results
+
+def make_size_report(modules, objects, frozen, main_module_name, output, map_file=None):
+	"""Returns a report of what each module adds to the output: it's source lines, generated C, object file, what it put in the linked file and what Cython generated for it, sorted by size.
+	objects maps module names to their object files, and frozen maps frozen modules to their bytecode. The linked sizes need a map file from the linker, and leave out bss and debug info."""
+	link_map=read_link_map(map_file) if map_file and path.exists(map_file) else {}
+	rows=[]
+	for i in modules:
+		with open(i.file, "rb") as f: lines=len(f.read().splitlines())
+		row=dict(name=i.name, kind="main" if i.name==main_module_name else "cython", source_lines=lines, c_bytes=path.getsize(i.cfile), object_bytes=None, linked_bytes=None, sections=None)
+		obj=objects.get(i.name)
+		if obj:
+			row["object_bytes"]=path.getsize(obj)
+			row["sections"]=link_map.get(path.normcase(path.abspath(obj)))
+		if row["sections"] is not None: row["linked_bytes"]=sum(v for k, v in row["sections"].items() if not k in ("bss", "debug"))
+		row.update(count_generated_code(i.cfile))
+		rows.append(row)
+	for i, code in frozen:
+		with open(i.file, "rb") as f: lines=len(f.read().splitlines())
+		rows.append(dict(name=i.name, kind="frozen", source_lines=lines, bytecode_bytes=len(code), c_bytes=None, object_bytes=None, linked_bytes=None, sections=None, python_api_calls=None, object_temps=None, c_temps=None)) # The bytecode is part of the main module
+	rows.sort(key=lambda row: (-(report_size(row) or 0), row["name"]))
+	return dict(output=output, output_bytes=path.getsize(output), modules=rows)
+
+def report_size(row):
+	# The size a module is sorted and compared by: what it added to the linked file if that's known, otherwise it's object file or bytecode.
+	for i in ("linked_bytes", "object_bytes", "bytecode_bytes"):
+		if row.get(i) is not None: return row[i]
+	return None
+
+def format_size_report(report, previous=None):
+	# Formats a report from make_size_report as a table. With a previous report, the last column is how much each module's size changed since then.
+	old={i["name"]: i for i in previous["modules"]} if previous else {}
+	columns=("source_lines", "c_bytes", "object_bytes", "linked_bytes", "python_api_calls", "object_temps", "c_temps")
+	table=[["module", "kind", "lines", "C", "object", "linked", "API calls", "object temps", "C temps"]+(["change"] if previous else [])]
+	for row in report["modules"]:
+		cells=[row["name"], row["kind"]]+["-" if row.get(i) is None else str(row[i]) for i in columns]
+		if previous: cells.append("%+d" % ((report_size(row) or 0)-(report_size(old[row["name"]]) or 0)) if row["name"] in old else "new")
+		table.append(cells)
+	for name in sorted(set(old)-set(i["name"] for i in report["modules"])): table.append([name, old[name]["kind"]]+["-"]*len(columns)+["removed"])
+	widths=[max(len(row[i]) for row in table) for i in range(len(table[0]))]
+	lines=["  ".join(cell.ljust(width) if i<2 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))) for row in table]
+	total=report["output"]+": "+str(report["output_bytes"])+" bytes"
+	if previous: total+=" (%+d)" % (report["output_bytes"]-previous["output_bytes"])
+	return "\n".join(lines+[total])
+
+class build_trace:
+	"""Records the wall time, CPU time and CPU time of child processes (like the C compiler) for each part of a build.
+	save() writes them in the Chrome trace format, which is JSON that chrome://tracing or https://ui.perfetto.dev can show."""
+	__slots__=("events", "start", "lock", "current")
+
+	def __init__(self):
+		import time, threading
+		self.events=[]
+		self.start=time.perf_counter()
+		self.lock=threading.Lock()
+		self.current=None
+
+	def phase(self, name, category="phase", **args): return trace_phase(self, name, category, args)
+
+	def next_phase(self, name=None, **args):
+		# Ends the current top level phase and starts the next one, if there is one.
+		if self.current is not None: self.current.__exit__(None, None, None)
+		self.current=None
+		if name is not None: self.current=self.phase(name, **args).__enter__()
+
+	def add_child_cpu(self, cpu):
+		# For child processes that are only waited for later, like the Cython workers, since os.times only counts them once they've been waited for.
+		if self.current is not None: self.current.worker_cpu+=cpu
+
+	def add(self, name, category, start, wall, cpu=None, child_cpu=None, **args):
+		import threading
+		if cpu is not None: args["cpu_ms"]=round(cpu*1000, 3)
+		if child_cpu is not None: args["child_cpu_ms"]=round(child_cpu*1000, 3)
+		event={"name": name, "cat": category, "ph": "X", "ts": round((start-self.start)*1e6), "dur": round(wall*1e6), "pid": os.getpid(), "tid": threading.get_ident(), "args": args}
+		with self.lock: self.events.append(event)
+
+	def summary(self, category="phase"):
+		return [(i["name"], i["dur"]/1e6, i["args"].get("cpu_ms", 0)/1000, i["args"].get("child_cpu_ms", 0)/1000) for i in sorted(self.events, key=lambda i: i["ts"]) if i["cat"]==category]
+
+	def save(self, filename):
+		import json
+		with open(filename, "w", encoding="UTF-8") as f:
+			json.dump({"traceEvents": sorted(self.events, key=lambda i: i["ts"]), "displayTimeUnit": "ms"}, f, indent=0)
+
+class trace_phase:
+	# Times the code in a with block for build_trace.
+	__slots__=("trace", "name", "category", "args", "start", "cpu", "children", "worker_cpu")
+
+	def __init__(self, trace, name, category, args):
+		self.trace, self.name, self.category, self.args=trace, name, category, args
+		self.worker_cpu=0
+
+	def __enter__(self):
+		import time
+		times=os.times()
+		self.children=times.children_user+times.children_system
+		self.cpu=time.process_time()
+		self.start=time.perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		import time
+		wall=time.perf_counter()-self.start
+		times=os.times()
+		cpu=child_cpu=None
+		if self.category=="phase":
+			# process_time and os.times count the whole process, so for work done in worker threads they'd include whatever the other threads did at the same time.
+			cpu=time.process_time()-self.cpu
+			child_cpu=times.children_user+times.children_system-self.children+self.worker_cpu
+		self.trace.add(self.name, self.category, self.start, wall, cpu, child_cpu, **self.args)
+		return False
+
 def fix_module(data, name):
 	#data=fix_docstring(data)
 	data=list(i.expandtabs(1) for i in data)
@@ -489,17 +1771,150 @@ def find_files(location, add_folders=False, add_files=True, extensions=("*",), m
 	if multiple_lists==False: return results
 	else: return files, folders
 
-def main(main_module: "The package or module name of the main module, which is the module which will be imported first by the user", *files: "A space seperated list of module or package names minus the extension that will be searched for in the current directory and on sys.path", package: "Specify weather to import from the main module, or to import modules globally"=False, method: "Select which method to use to build the Cython extension"="1", encoding: "The text encoding to use for the files, default is UTF-8"="UTF-8", import_all: "Cause the extension, when imported, to load all the contained modules"=False, name: "The name of the main module, don't set to use the default"=None, show_modules: "Set weather the extension module will have a list attribute called modules which lists the modules contained in it, default  is False"=False, exe: "Weather to make an exe that starts the main module when launched and can still load other modules. WARNING! Only works for method 2! "=False, protect_function: "The name of a function in the main module that is called whenever a module is about to be imported. If the function returns False, the importing is stopped and if it returns True, it is allowed to continue"=None, compiler_options: "Comma seperated list of compiler options"='', no_cython_processes: "You seem to need to use this option when setting custom compiler directives. This option compiles your Cython code using only the current process. This is slower, but otherwise the compiler directives don't carry across processes."=False, keep_temp: "Set this option to stop the build_temp from being deleted"=False, build_temp: "Set where the build_temp directory should be put"='', output: "Set where the resulting Python extension module is placed, leave empty to use the default settings"='', compiler_directives: "A comma seperated set of compiler directives to pass to Cython"='', cinclude: "A list of comma seperated directory names that will be used to search for extra required C files"='', clib: "A comma seperated list of C libraries to link with"='', prompt: "Weather to prompt for the removal of temporary dirs or files, default is True"=True, init_code: "Allows you to insert extra code by specifying a filename that you need run before the multimodule importer runs. Warning! This code will not have access to the embedded modules, but it will still be embedded. If you want to store a docstring for the main module, you can put it in the embedded code"=None, verbose: "control the verbosity level, the lower the quieter, default is 2."=2, exclude_unused: "Tries to determin all the imported modules and removes any extra modules from the extension that aren't used by the rest. Default is False."=False, exclude_modules: "A comma seperated list of module names to include."="", ccompiler: "The compiler to use to compile the code. Any uses distutils.ccompiler.new_compiler,."="", extra_compile_args: "Extra args to pass on to the c compiler"="", extra_link_args: "Extra args to pass onto the linker"=""):
+def get_watched_files(main_module, files, package, init_code=None, ext=(".pyx", ".py", ".pyw"), data="", directory="."):
+	# Returns the sources, their .pxd and .pxi files and the directories they're in, which is everything a build depends on.
+	directory=path.abspath(directory)
+	main_module_name=get_name(path.join(directory, main_module))
+	results=set()
+	for i in files_to_module(locate_modules(files, ext=ext, directory=directory)+locate_modules(main_module, ext=ext, directory=directory), package, main_module_name):
+		results.add(i.file)
+		results.add(path.dirname(i.file)) # So new and removed files are noticed
+		results.update(path.abspath(j) for j in companion_files(i))
+	if init_code: results.add(path.join(directory, init_code))
+	if data:
+		import glob
+		for i in data.split(","):
+			if i.strip(): results.update(path.abspath(j) for j in glob.glob(path.join(directory, i.strip()), recursive=True))
+	return results
+
+def watch_build(options, interval=0.5):
+	"""Builds the extension, then keeps checking the files it was built from and builds it again whenever they change, until it's interrupted.
+	Cython and the compiler stay loaded, and the builds use the cache, so only the modules that changed are cythonized and compiled again."""
+	import time, traceback
+	options=dict(options, watch=False, prompt=False, stable_names=True) # A new random PyInit name for a changed module would change the main module too
+	if not options["cache"]: options["cache"]=path.join(tempfile.gettempdir(), "multimodule_cache")
+	main_module=options.pop("main_module")
+	files=options.pop("files")
+	cwd=os.getcwd()
+	mtimes={}
+	rescanned=False
+	while True:
+		try:
+			watched=get_watched_files(main_module, files, options["package"], options["init_code"], data=options["data"], directory=options["directory"] or ".")
+			current={}
+			for i in watched:
+				try: current[i]=os.stat(i).st_mtime_ns
+				except OSError: current[i]=None
+			changed=[i for i in current if current[i]!=mtimes.get(i, 0)]
+			if len(changed)==0:
+				time.sleep(interval)
+				continue
+			if len(mtimes)>0 and not rescanned and any(path.isdir(i) or current[i] is None for i in changed):
+				# Files were added or removed, so look for the modules again before building.
+				_located_modules.clear()
+				_file_index.clear()
+				_cached_names.clear()
+				rescanned=True
+				continue
+			if len(mtimes)>0: print("Changed:", ', '.join(changed))
+			rescanned=False
+			mtimes=current
+			start=time.perf_counter()
+			try: main(main_module, *files, **options)
+			except SystemExit as e:
+				if e.code not in (None, 0): eprint("The build failed.")
+			except Exception:
+				traceback.print_exc()
+				eprint("The build failed.")
+			finally:
+				for i in tuple(_open_pools): i.close() # Left open by a build that failed
+				os.chdir(cwd)
+			print("Build took", round(time.perf_counter()-start, 2), "seconds. Watching", len(watched), "files and directories for changes, press control+c to stop.")
+		except KeyboardInterrupt:
+			print("Stopped watching")
+			return
+
+def load_manifest(filename):
+	"""Reads a JSON or TOML build manifest and returns the shared options and a dictionary of targets."""
+	import json, inspect
+	with open(filename, "rb") as f: raw=f.read()
+	if filename.lower().endswith(".toml"):
+		try: import tomllib
+		except ImportError:
+			try: import tomli as tomllib
+			except ImportError: die("Reading a TOML manifest needs Python 3.11 or the tomli package, use a JSON manifest instead")
+		try: data=tomllib.loads(raw.decode("UTF-8"))
+		except tomllib.TOMLDecodeError as e: die("Couldn't read the manifest "+filename+": "+str(e))
+	else:
+		try: data=json.loads(raw.decode("UTF-8"))
+		except ValueError as e: die("Couldn't read the manifest "+filename+": "+str(e))
+	shared=data.get("options", {})
+	targets=data.get("targets", {})
+	if not isinstance(shared, dict) or not isinstance(targets, dict) or len(targets)==0: die("The manifest "+filename+" needs a targets table with at least one target, and options has to be a table if it's there")
+	known=set(inspect.signature(main).parameters)
+	for name, settings in (("options", shared),)+tuple(targets.items()):
+		if not isinstance(settings, dict): die("The target "+name+" in the manifest should be a table of settings")
+		unknown=[i for i in settings if not i in known]
+		if len(unknown)>0: die("Unknown settings for "+name+" in the manifest: "+', '.join(unknown))
+	for name, settings in targets.items():
+		if not "main_module" in settings and not "main_module" in shared: die("The target "+name+" in the manifest doesn't have a main_module")
+	return shared, targets
+
+def manifest_build(options):
+	"""Builds the targets in a manifest at the same time, with one build_pool shared between them.
+	Returns once every target is done, and exits with an error if any of them failed."""
+	import inspect, threading, time
+	global _shared_build
+	manifest=path.abspath(options["manifest"])
+	shared, targets=load_manifest(manifest)
+	wanted=(options["main_module"],)+tuple(options["files"])
+	if not "*" in wanted:
+		missing=[i for i in wanted if not i in targets]
+		if len(missing)>0: die("The manifest doesn't have these targets: "+', '.join(missing)+". It has "+', '.join(targets))
+		targets={i: targets[i] for i in wanted}
+	defaults={name: i.default for name, i in inspect.signature(main).parameters.items() if i.default is not i.empty}
+	command_line={i: options[i] for i in defaults if options[i]!=defaults[i] and i!="manifest"}
+	try: jobs=int(command_line.get("jobs", shared.get("jobs", 0)))
+	except ValueError: die("Invalid value for jobs, expected int")
+	pool=build_pool(jobs)
+	_shared_build=pool
+	results={}
+	def build_target(name):
+		settings=dict(shared, **command_line)
+		settings.update(targets[name])
+		settings["directory"]=path.join(path.dirname(manifest), settings.get("directory", "."))
+		main_module=settings.pop("main_module")
+		files=settings.pop("files", ())
+		if isinstance(files, str): files=files.split()
+		settings.update(prompt=False, watch=False, manifest="")
+		try:
+			main(main_module, *files, **settings)
+			results[name]=True
+		except SystemExit as e: results[name]=e.code in (None, 0)
+		except Exception:
+			eprint(traceback.format_exc())
+			results[name]=False
+	start=time.perf_counter()
+	print("Building", len(targets), "targets:", ', '.join(targets))
+	threads=[threading.Thread(target=build_target, args=(i,), name="multimodule "+i) for i in targets]
+	try:
+		for i in threads: i.start()
+		for i in threads: i.join()
+	finally:
+		_shared_build=None
+		pool.close()
+	failed=[i for i in targets if not results.get(i)]
+	print("Built", len(targets)-len(failed), "of", len(targets), "targets in", round(time.perf_counter()-start, 2), "seconds")
+	if len(failed)>0: die("These targets failed: "+', '.join(failed))
+
+def main(main_module: "The package or module name of the main module, which is the module which will be imported first by the user", *files: "A space seperated list of module or package names minus the extension that will be searched for in the current directory and on sys.path", package: "Specify weather to import from the main module, or to import modules globally"=False, method: "Select which method to use to build the Cython extension"="1", encoding: "The text encoding to use for the files, default is UTF-8"="UTF-8", import_all: "Cause the extension, when imported, to load all the contained modules"=False, import_profile: "Record how long each embedded module takes to find and import. The times can be read with import_times() or import_report() on the main module, and setting the MULTIMODULE_IMPORTTIME environment variable turns this on at run time and prints a report at exit"=False, lazy_import: "Give the main module and the embedded packages a module __getattr__ that imports submodules the first time they're used as attributes, instead of importing them all up front"=False, preload: "Give the main module a preload() function that imports the embedded modules ahead of time in a background thread, after the modules they import"=False, name: "The name of the main module, don't set to use the default"=None, show_modules: "Set weather the extension module will have a list attribute called modules which lists the modules contained in it, default  is False"=False, exe: "Make an executable with the interpreter embedded in it, which runs the main module's __main__ module, or the main module itself, when launched. Set output to name it"=False, protect_function: "The name of a function in the main module that is called whenever a module is about to be imported. If the function returns False, the importing is stopped and if it returns True, it is allowed to continue"=None, compiler_options: "Comma seperated list of compiler options"='', no_cython_processes: "Run Cython in the current process only, one file at a time, instead of in a pool of worker processes. Compiler options and directives are set up in every worker either way"=False, keep_temp: "Set this option to stop the build_temp from being deleted"=False, build_temp: "Set where the build_temp directory should be put"='', output: "Set where the resulting Python extension module is placed, leave empty to use the default settings"='', compiler_directives: "A comma seperated set of compiler directives to pass to Cython"='', cinclude: "A list of comma seperated directory names that will be used to search for extra required C files"='', clib: "A comma seperated list of C libraries to link with"='', prompt: "Weather to prompt for the removal of temporary dirs or files, default is True"=True, init_code: "Allows you to insert extra code by specifying a filename that you need run before the multimodule importer runs. Warning! This code will not have access to the embedded modules, but it will still be embedded. If you want to store a docstring for the main module, you can put it in the embedded code"=None, verbose: "control the verbosity level, the lower the quieter, default is 2."=2, exclude_unused: "Follows the imports from the main module and removes any modules from the extension that it can't reach. Default is False."=False, exclude_modules: "A comma seperated list of module names to include."="", ccompiler: "The compiler to use to compile the code. clang uses clang from the path, anything else uses distutils.ccompiler.new_compiler."="", extra_compile_args: "Extra args to pass on to the c compiler"="", extra_link_args: "Extra args to pass onto the linker"="", trace: "Save how long each part of the build took in this file, using the Chrome trace JSON format"="", watch: "Keep running after the build and build again whenever one of the source files changes. Uses the cache, so only modules that changed are rebuilt"=False, jobs: "How many C files to compile at the same time. The default of 0 uses one job for each CPU"=0, stable_names: "Name the PyInit symbols of the embedded modules from a hash of the module name instead of random letters, so building the same sources always gives the same C code"=False, cache: "A directory where generated C files and object files are kept between builds, so modules that haven't changed aren't cythonized or compiled again. Leave empty to disable"="", manifest: "A JSON or TOML file describing several extensions to build at the same time. The main module and files then name the targets to build, use * for all of them"="", precompiled_header: "Precompile Python.h and the other headers every generated C file includes once, and use it for all of them. Works with gcc and clang"=False, freeze: "A comma seperated list of .py modules to embed as bytecode instead of compiling them with Cython"="", freeze_size: "Embed every .py module smaller than this many bytes as bytecode instead of compiling it. 0 turns this off"=0, freeze_profile: "A cProfile or pstats file. .py modules that took less than one percent of the profiled time are embedded as bytecode, and the rest are compiled"="", pgo: "A Python script that uses the extension, to train a profile guided optimization build with. Works with gcc and clang"="", size_report: "Save how much each module adds to the extension in this JSON file, and print it as a table. If the file is already there, the table shows how much each module changed since then"="", data: "A comma seperated list of glob patterns for data files to embed in the packages they're in. importlib.resources reads them from the extension without copying them"="", isolated: "Start the exe's interpreter in isolated mode, which ignores PYTHON environment variables and the user site directory"=False, no_site: "Don't import the site module when the exe starts, which makes it start faster but leaves site-packages off sys.path"=False, directory: "Where to look for the modules before sys.path. Relative paths in the other options are relative to it as well. Leave empty to use the current directory"=""):
 	__doc__
-	global cythonize, glob, path, CythonOptions, ModuleSpec, begin, os, sys, random, traceback, tempfile, importlib, chardet, multiprocessing, ext, tempdir
+	options=dict(locals()) # Remembered so watch mode can build again with the same settings.
+	global cythonize, path, CythonOptions, ModuleSpec, begin, os, sys, random, traceback, tempfile, importlib, chardet, multiprocessing, ext
 	from Cython.Build import cythonize
 	from Cython.Compiler import Options as CythonOptions
-	from distutils.ccompiler import new_compiler
-	from distutils.command.build_ext import customize_compiler, build_ext
-	from distutils.dist import Distribution
 	from importlib.machinery import ModuleSpec
-	from glob import glob
-	import begin, os, sys, random, traceback, tempfile, importlib, sysconfig
+	import begin, os, sys, random, traceback, tempfile, importlib, sysconfig, io
 	from os import path
 	try: import chardet
 	except ImportError: chardet=None
@@ -508,6 +1923,10 @@ def main(main_module: "The package or module name of the main module, which is t
 	from Cython.Compiler.Errors import CompileError
 	extra_ext=(".pyx",)
 	ext=tuple(importlib.machinery.all_suffixes())+extra_ext
+	if manifest:
+		if watch==True: die("watch can't be used with a manifest")
+		return manifest_build(options)
+	if watch==True: return watch_build(options)
 
 	mods=[]
 	if prompt==True:
@@ -520,21 +1939,41 @@ def main(main_module: "The package or module name of the main module, which is t
 	try: verbose=int(verbose)
 	except ValueError: die("Invalid value for verbose, expected int but got ", verbose)
 	if verbose<0 or verbose>3: die("Verbose is not in the expected range (0,2)")
+	try: method=int(method)
+	except ValueError: die("Invalid value for method, expected 1 or 2 but got ", method)
+	if not method in (1, 2): die("Method should be 1 or 2, not ", method)
+	try: jobs=int(jobs)
+	except ValueError: die("Invalid value for jobs, expected int but got ", jobs)
+	try: freeze_size=int(freeze_size)
+	except ValueError: die("Invalid value for freeze_size, expected int but got ", freeze_size)
 	if verbose<2: say_anything=say_nothing
 	if verbose<1: say_something_interesting=say_nothing
-	main_module_name=get_name(main_module)
+	context=_shared_build
+	if context is None: context=build_pool(jobs)
+	# Other builds can be running in this process, so nothing uses the current directory. Relative paths are relative to directory instead.
+	directory=path.abspath(directory or ".")
+	absolute=lambda i: path.normpath(path.join(directory, i)) if i else i
+	output, trace, cache, pgo, size_report, build_temp, init_code, freeze_profile=(absolute(i) for i in (output, trace, cache, pgo, size_report, build_temp, init_code, freeze_profile))
+	if pgo and cache:
+		eprint("Warning, the cache isn't used for PGO builds")
+		cache=""
+	if cinclude: cinclude=','.join(absolute(i) for i in cinclude.split(","))
+	if data: data=','.join(absolute(i.strip()) for i in data.split(",") if i.strip())
+	tracer=build_trace()
+	tracer.next_phase("locate")
+	main_module_name=get_name(path.join(directory, main_module))
 	say_something_interesting("Modules:", ', '.join((main_module,)+files))
 	f=[]
 	say_anything("Checking files...")
 	ext=(".pyx", ".py", ".pyw")
-	f=locate_modules(files, ext=ext)
-	main_files=locate_modules(main_module, ext=ext)
+	f=locate_modules(files, ext=ext, directory=directory)
+	main_files=locate_modules(main_module, ext=ext, directory=directory)
 	if len(main_files)==0: die("Couldn't find main module")
-	extra_compile_args=extra_compile_args.split(" ")
-	extra_link_args=extra_link_args.split(" ")
+	extra_compile_args=extra_compile_args.split()
+	extra_link_args=extra_link_args.split()
 	if not build_temp:
 		build_temp=path.join(tempfile.gettempdir(), "multimodule_build_temp"+get_random_letters(5))
-	tempdir=build_temp # Remember the temp dir so we can clean it up if the app crashes.
+	tempdirs.append(build_temp) # Remember the temp dir so we can clean it up if the app crashes.
 	if path.exists(build_temp):
 		res=prompt_func("The temporary directory "+build_temp+" already exists")
 		if res: die("Exiting")
@@ -543,10 +1982,12 @@ def main(main_module: "The package or module name of the main module, which is t
 	output_ext=".pyd"
 	if not sys.platform=="win32": output_ext=".so"
 	if not output:
-		output=main_module_name+output_ext
-		output=path.abspath(output)
+		output=path.join(directory, main_module_name+output_ext)
+		if exe==True:
+			output=path.join(directory, main_module_name+(sysconfig.get_config_var("EXE") or ""))
+			if path.isdir(output): output+="_exe" # Usually the package's own directory
 	if path.exists(output):
-		for i in sys.modules.values():
+		for i in tuple(sys.modules.values()): # Other threads may import modules meanwhile
 			if vars(i).get("__file__", "")==output:
 				die("The file "+output+" already exists and is loaded as module "+str(i)+". You'll need to remove it manually before you can successfully compile.")
 		res=prompt_func("Warning, output file "+output+" already exists. ")
@@ -555,7 +1996,8 @@ def main(main_module: "The package or module name of the main module, which is t
 	say_anything("Main module: ", main_module_name)
 	say_something_interesting("Output filename: ", output)
 	mods=files_to_module(f, package, main_module_name)
-	if len(main_files)>1: # This is hopefully a package
+	main_is_package=len(main_files)>1
+	if main_is_package: # This is hopefully a package
 		init_name=main_module_name+".__init__"
 		for i in main_files:
 			if get_name(i)==init_name:
@@ -567,19 +2009,15 @@ def main(main_module: "The package or module name of the main module, which is t
 	else:
 		main_module=main_files[0]
 	main_module_object,=files_to_module((main_module,), package, main_module_name)
+	tracer.next_phase("setup")
+	opts={}
 	if compiler_options:
 		compiler_options=compiler_options.replace(",", "\n")
 		compiler_options=compile(compiler_options, "setting up compiler options", "exec", optimize=2)
-		opts={}
 		exec(compiler_options, opts, opts)
 		if '__builtins__' in opts: del opts["__builtins__"]
 		if len(opts)>0:
 			say_something_interesting("Compiler options set: ", ', '.join(opts.keys()))
-		for i in opts.keys():
-			setattr(CythonOptions, i, opts[i])
-		if len(opts)>0 and no_cython_processes==False:
-			eprint("Warning: Cython will compile files with only a single process in order to allow the compiler options you've set to take effect")
-			no_cython_processes=True
 	directives={}
 	if compiler_directives:
 		compiler_directives=compiler_directives.replace(",", "\n")
@@ -592,13 +2030,13 @@ def main(main_module: "The package or module name of the main module, which is t
 	main_location=path.join(build_temp, main_module_name+".pyx")
 	main_location=path.abspath(main_location)
 	if exclude_unused==True:
+		tracer.next_phase("find unused modules")
 		say_anything("Trying to find unused modules...")
-		imported_list=find_imports(main_module_object.file, main_module_object.name)
-		for i in mods:
-			imported_list.update(find_imports(i.file, i.name))
+		if cache and not path.exists(cache): os.makedirs(cache)
+		used=find_used_modules(main_module_object, mods, encoding, cache or None)
 		for i in tuple(mods):
-			if not i.name in imported_list:
-				say_something_interesting("Module "+i.name+" isn't imported anywhere so it was removed from the compilation.")
+			if not i.name in used:
+				say_something_interesting("Module "+i.name+" can't be reached by following imports from the main module so it was removed from the compilation.")
 				mods.remove(i)
 		if len(mods)==0: die("No modules were left after removing unused ones.")
 	if exclude_modules:
@@ -612,16 +2050,80 @@ def main(main_module: "The package or module name of the main module, which is t
 				if j.name.startswith(i+"."): # Remove submodules of a package
 					say_anything("Recursively excluded "+j.name)
 					mods.remove(j)
-	add_importer=len(mods)>0
-	p=open(main_location, "w", encoding="UTF-8")
+	data_files=[]
+	if data:
+		data_files=find_data_files(data, tuple(mods)+(main_module_object,))
+		say_something_interesting("Embedding", len(data_files), "data files")
+	import_order=()
+	if preload==True:
+		tracer.next_phase("find import order")
+		if cache and not path.exists(cache): os.makedirs(cache)
+		import_order=get_import_order(mods, main_module_object, encoding, cache or None)
+	frozen={}
+	frozen_mods=[]
+	if freeze or freeze_size>0 or freeze_profile:
+		tracer.next_phase("freeze")
+		for i in choose_frozen_modules(mods, freeze, freeze_size, freeze_profile):
+			with tracer.phase("freeze "+i.name, "freeze"): frozen[i.name]=freeze_module(i, encoding)
+			mods.remove(i)
+			frozen_mods.append(i)
+		if len(frozen)>0: say_something_interesting("Embedding", len(frozen), "modules as bytecode:", ', '.join(frozen))
+	tracer.next_phase("preprocess main module")
+	add_importer=len(mods)+len(frozen)+len(data_files)>0
+	p=io.StringIO() # The main module is put together in memory and only written once it's been fixed.
 	if not path.exists(main_module) or not path.isfile(main_module):
 		die("Main module "+main_module+" could not be found")
 	data=open_file(main_module, encoding=encoding)
+	cache_obj=None
+	if cache:
+		import Cython
+		cache_obj=build_cache(cache, Cython.__version__, sys.version, sys.platform, sorted(directives.items()), sorted(opts.items()), extra_compile_args, ccompiler, encoding, stable_names)
+		with tracer.phase("hash modules", "cache"):
+			shared=set()
+			for i in mods+[main_module_object]: shared.update(path.abspath(j) for j in companion_files(i))
+			for i in cinclude.split(","):
+				if i and path.isdir(i): shared.update(find_files(i, extensions=(".h", ".hpp", ".hh")))
+			cache_obj.depend_on(*sorted(shared))
+			for i in mods: i.key=cache_obj.file_key(i.name, i.file, *companion_files(i))
 	names={}
+	if method==2: names=dict.fromkeys(i.name for i in mods) # Everything goes in the main module, so nothing needs it's own PyInit function.
+	cached={}
+	for i in mods:
+		if cache_obj is None: break
+		hit=cache_obj.get(i.key)
+		if hit is None or i.name in names or hit[2] in names.values(): continue
+		names[i.name]=hit[2]
+		cached[i.name]=hit
+	if len(cached)>0: say_something_interesting("Reusing", len(cached), "cached modules:", ', '.join(cached.keys()))
+	if (stable_names==True or cache_obj is not None) and method==1: # A random name would change the main module's symbol table on every rebuild
+		mods.sort(key=lambda i: i.name)
+		used={"PyInit_"+main_module_name}
+		for i in mods:
+			length=8
+			j=get_stable_symbol(i.name, length)
+			while j in used:
+				say_anything("The symbol "+j+" for "+i.name+" is already used, making it longer")
+				length+=8
+				if length>64: die("Couldn't find a unique PyInit symbol for "+i.name)
+				j=get_stable_symbol(i.name, length)
+			used.add(j)
+			if i.name in cached and cached[i.name][2]!=j: del cached[i.name]
+			names[i.name]=j
 	for i in mods:
+		if i.name in names: continue
 		j="PyInit_"+get_random_letters(8)
 		while j in names.values(): j+=get_random_letters(1)
 		names[i.name]=j
+	names={i.name: names[i.name] for i in mods} # The cached ones were added first, so put them in order to keep the main module the same
+	exe_main=None
+	if exe==True:
+		for i in (main_module_name+".__main__", "__main__"):
+			if i in names or i in frozen:
+				exe_main=i
+				break
+		else:
+			if not main_is_package: exe_main=main_module_name
+			say_anything("There's no embedded __main__ module, so the exe "+("runs "+main_module_name+" as __main__" if exe_main else "only imports "+main_module_name))
 	p.write("#coding: UTF-8\n")
 	if init_code:
 		init_file=open_file(init_code, encoding=encoding)
@@ -630,11 +2132,44 @@ def main(main_module: "The package or module name of the main module, which is t
 		say_something_interesting("Embedded code from "+init_code+" at the start of "+main_module_name)
 
 
+	if exe==True and exe_main==main_module_name:
+		# The exe imports the main module as __main__, so make it importable by it's real name as well.
+		p.write("if __name__=='__main__':\n\timport sys\n\tsys.modules["+repr(main_module_name)+"]=sys.modules[__name__]\n\tdel sys\n\n")
 	if add_importer:
-		p.write("cdef dict __module_dict__={\n")
-		for i in names:
-			p.write(" '"+i+"':'"+names[i].replace("PyInit_", "")+"',\n")
-		p.write("}")
+		if method==2: p.write(unity_module_code)
+		else:
+			p.write("cdef extern from *:\n\t\"\"\"\n")
+			for i in names: p.write("PyMODINIT_FUNC "+names[i]+"(void);\n")
+			p.write("static PyObject *(*const multimodule_inits[])(void)={"+(', '.join(names.values()) or "NULL")+"};\n")
+			p.write(init_table_code)
+		p.write("cdef dict __module_dict__={\n") # Maps module names to their place in multimodule_inits, or multimodule_functions with method 2
+		for i, j in index_range(names):
+			p.write(" '"+j+"':"+str(i)+",\n")
+		p.write("}\n")
+		p.write("cdef dict __frozen_modules__=dict()\n") # Maps the names of frozen modules to their marshalled code
+		for i in frozen:
+			code=frozen[i]
+			if len(code)<=16000: p.write("__frozen_modules__['"+i+"']="+repr(code)+"\n")
+			else: p.write("__frozen_modules__['"+i+"']=b''.join((\n"+''.join(" "+repr(code[j:j+16000])+",\n" for j in range(0, len(code), 16000))+"))\n") # Some C compilers can't handle very long strings
+		import importlib.util
+		p.write("cdef bytes __frozen_magic__="+repr(importlib.util.MAGIC_NUMBER)+"\n")
+		module_data={}
+		for index, (package_name, name, filename) in index_range(data_files): module_data.setdefault(package_name, {})[name]=index
+		p.write("cdef dict __module_data__="+repr(module_data)+"\n") # Maps package names to the paths of their data files and their place in multimodule_data
+		p.write(get_data_table_code(len(data_files)))
+		embedded_names=tuple(names)+tuple(frozen)
+		# Every name that has embedded submodules, so the importer doesn't need to search __module_dict__ for them.
+		p.write("cdef frozenset __module_packages__=frozenset((\n")
+		for i in sorted(get_package_names(embedded_names)): p.write(" '"+i+"',\n")
+		p.write("))\n")
+		children={}
+		if lazy_import==True: children=get_module_children(embedded_names+tuple(get_package_names(embedded_names)), main_module_name)
+		p.write("cdef dict __module_children__="+repr(children)+"\n")
+		if preload==True:
+			p.write("cdef tuple __module_order__=(\n") # The order preload imports modules in
+			for i in import_order: p.write(" '"+i+"',\n")
+			p.write(")\n")
+		p.write("cdef bint __import_profile__="+str(import_profile==True)+"\n")
 	if show_modules==True:
 		f.append("\nmodules=[")
 		for i in names: f.append("'"+i+"',")
@@ -643,37 +2178,69 @@ def main(main_module: "The package or module name of the main module, which is t
 		importer=embedded_code
 		if protect_function!=None: importer=protect_importer(importer, protect_function)
 		p.write(importer)
+		if preload==True: p.write(preload_code)
 		p.write("\n\n")
+		if method==2:
+			say_anything("Putting", len(mods), "modules inside", main_module_name)
+			write_unity_modules(p, [i for i in mods if i.name in names], encoding)
 	p.writelines(data)
 	if import_all==True:
-		for i in names: p.write("import "+i+"\n")
+		for i in tuple(names)+tuple(frozen): p.write("import "+i+"\n")
+	if lazy_import==True and add_importer:
+		p.write("\nif not '__getattr__' in globals(): __getattr__, __dir__=multimodule_lazy_attributes(__name__)\n")
 
-	p.close()
-	data=open_file(main_location, encoding="UTF-8")
-	data=fix_module(data, main_module_name)
+	data=fix_module(p.getvalue().splitlines(True), main_module_name)
 	with open(main_location, mode="w", encoding="UTF-8") as p: p.writelines(data)
 	say_anything("Compiling...")
 	cythonize_files=[]
+	if method==2: mods.clear() # They're all inside the main module now
 	mods.append(mod(name=main_module_name, shortname=main_module_name, file=main_location, pyfile=main_location))
-	os.chdir(build_temp)
+	if cache_obj is not None:
+		mods[-1].key=cache_obj.file_key(main_module_name, main_location, *companion_files(main_module_object))
+		hit=cache_obj.get(mods[-1].key)
+		if hit is not None: cached[main_module_name]=hit
+	tracer.next_phase("preprocess modules")
+	def preprocess_one(i):
+		with tracer.phase("preprocess "+i.name, "preprocess"): preprocess_module(i, i.pyfile, encoding)
+	todo=[]
 	for i in mods:
-		if i.name==main_module_name: continue
-		relname=i.name
-		relname+=path.splitext(i.file)[1]
-		i.pyfile=relname
-		contents=open_file(i.file, encoding=encoding)
-		s=open(relname, "w", encoding="UTF-8")
-		s.write("#coding: UTF-8\n")
-		contents=fix_module(contents, i.name)
-		s.writelines(contents)
-		s.close()
-		cythonize_files.append(relname)
-	cythonize_files.append(path.relpath(main_location))
+		if i.name in cached: i.cfile=cached[i.name][0]
+		if i.name==main_module_name or i.name in cached: continue
+		i.pyfile=path.join(build_temp, i.name+path.splitext(i.file)[1])
+		todo.append(i)
+		cythonize_files.append(path.basename(i.pyfile)) # Cython is run in build_temp, so the generated code doesn't have it's random path in it
+	for i in context.threads.map(preprocess_one, todo): pass # Raises the first exception, if there was one
+	if not main_module_name in cached: cythonize_files.append(path.basename(main_location))
 	nthreads=0
 	if not multiprocessing==None: nthreads=os.cpu_count()
 	if no_cython_processes==True: nthreads=0
+	results=[]
+	tracer.next_phase("cythonize", modules=len(cythonize_files))
 	try:
-		results=cythonize(cythonize_files, language_level="3", compiler_directives=directives, nthreads=nthreads, quiet=verbose<1)
+		if nthreads==0 and len(cythonize_files)>0:
+			# Cython's options and the current directory belong to the whole process, so builds take turns and put them back afterwards.
+			with context.lock:
+				cwd=os.getcwd()
+				saved={i: getattr(CythonOptions, i) for i in opts if hasattr(CythonOptions, i)}
+				try:
+					for i in opts: setattr(CythonOptions, i, opts[i])
+					os.chdir(build_temp)
+					# Going one file at a time anyway, so time each one.
+					for i in cythonize_files:
+						with tracer.phase("cythonize "+i, "cythonize"): results.extend(cythonize([i], language_level="3", compiler_directives=directives, quiet=verbose<1))
+				finally:
+					os.chdir(cwd)
+					for i in opts:
+						if i in saved: setattr(CythonOptions, i, saved[i])
+						else: delattr(CythonOptions, i)
+		elif len(cythonize_files)>0:
+			processes=context.cython_processes()
+			jobs_running=[processes.submit(cythonize_in_worker, build_temp, i, opts, directives, verbose<1) for i in cythonize_files]
+			for i, job in zip(cythonize_files, jobs_running):
+				extensions, start, wall, cpu=job.result()
+				tracer.add("cythonize "+i, "cythonize", start, wall, cpu)
+				tracer.add_child_cpu(cpu)
+				results.extend(extensions)
 	except CompileError:
 		die("Failed to cythonize the code")
 	cfiles=[]
@@ -681,70 +2248,140 @@ def main(main_module: "The package or module name of the main module, which is t
 		for j in mods:
 			if j.name==i.name: break
 		if not j.name==i.name: die("Error when compiling Cython code. Cannot find module in the mods list with name "+str(i.name))
-		valid=tuple(k for k in i.sources if path.relpath(k).startswith(j.name))
+		valid=tuple(k for k in i.sources if path.relpath(path.join(build_temp, k), build_temp).startswith(j.name))
 		if len(valid)!=1: die("Error with sources for "+str(i)+". Can't decide which one to use. ", valid)
-		src=path.abspath(valid[0])
+		src=path.join(build_temp, valid[0])
 		cfiles.append(src)
 		j.cfile=src
+	tracer.next_phase("compiler setup")
+	macros={}
 	for i in mods:
-		realname=i.name
-		name=i.shortname
-		if realname==main_module_name and realname not in names:
-			continue
 		if not path.exists(i.cfile): die("Unknown error. C code file "+i.cfile+" should exist but doesn't")
-		with open(i.cfile, "r", encoding=encoding) as f: data=f.read()
-		data=data.replace("PyInit_"+name, names[realname])
-		say_anything("Replaced PyInit_"+name+" with "+names[realname])
-		with open(i.cfile, "w", encoding=encoding) as f: f.write(data)
-	dist=Distribution()
-	cmd=build_ext(dist)
-	cmd.finalize_options()
-	#This modified code snippet was taken from distutils.command.build_ext.run
-	if not ccompiler: ccompiler=cmd.compiler
-	com=new_compiler(compiler=ccompiler, verbose=verbose>=3)
-	customize_compiler(com)
-	if cmd.include_dirs is not None:
-		com.set_include_dirs(cmd.include_dirs)
-	if cmd.define is not None:
-		for (name, value) in cmd.define:
-			com.define_macro(name, value)
-	if cmd.undef is not None:
-		for macro in cmd.undef:
-			com.undefine_macro(macro)
-	if cmd.libraries is not None:
-		com.set_libraries(cmd.libraries)
-	if cmd.library_dirs is not None:
-		com.set_library_dirs(cmd.library_dirs)
-	if cmd.rpath is not None:
-		com.set_runtime_library_dirs(cmd.rpath)
-	if cmd.link_objects is not None:
-		com.set_link_objects(cmd.link_objects)
-
-
-
-
-	try: objs=com.compile(cfiles, extra_postargs=extra_compile_args)
-	except Exception as e:
-		input(e)
-		import traceback
-		print(traceback.format_exc())
-		eprint("Couldn't compile the C files to object code")
-		sys.exit()
-	say_anything("Linking...")
-	symbols=list(names.values())
-	symbols.append("PyInit_"+main_module_name)
-	try: com.link_shared_object(objs, output, export_symbols=symbols, extra_postargs=extra_link_args)
-	except:
-		eprint("Oops, something broke")
-		sys.exit()
-	if keep_temp==False:
-		clean_temp(build_temp)
+		if i.name in names and not i.name in cached:
+			# Cython names the function after the last part of the module name, so rename it while compiling.
+			macros[i.cfile]=[("PyInit_"+i.shortname, names[i.name])]
+	com=context.compiler((ccompiler, cinclude, verbose>=3), lambda: make_compiler(ccompiler, cinclude, verbose))
+	extra_cfiles=[]
+	extra_objs=[] # Object files from the cache that aren't modules
+	data_key=None
+	if len(data_files)>0:
+		tracer.next_phase("embed data", files=len(data_files))
+		hit=None
+		if cache_obj is not None:
+			with tracer.phase("hash data files", "cache"): data_key=cache_obj.file_key("multimodule_data", *(i[2] for i in data_files)) # The C file only depends on what's in the files, in this order
+			hit=cache_obj.get(data_key)
+		if hit is not None: extra_objs.append(hit[1])
+		else:
+			extra_cfiles.append(path.join(build_temp, "multimodule_data.c"))
+			write_data_file(extra_cfiles[0], [i[2] for i in data_files], getattr(com, "compiler_type", None)!="msvc")
+			cfiles.extend(extra_cfiles)
+	if stable_names==True and (isinstance(com, clang_compiler) or com.compiler_type=="unix"):
+		extra_compile_args.append("-ffile-prefix-map="+build_temp+"=.") # Keep the random build_temp path out of the debug info.
+	symbols=["PyInit_"+main_module_name] # The other PyInit functions are called through multimodule_inits, so they don't need exporting.
+	user_link_args=extra_link_args
+	if sys.platform.startswith("linux"):
+		# distutils ignores export_symbols on unix, so use a version script to hide everything else.
+		version_script=path.join(build_temp, "exports.map")
+		with open(version_script, "w", encoding="UTF-8") as f: f.write("{ global: "+'; '.join(symbols)+"; local: *; };\n")
+		extra_link_args=extra_link_args+["-Wl,--version-script="+version_script]
+	map_args=[]
+	if size_report and sys.platform.startswith("linux") and (isinstance(com, clang_compiler) or com.compiler_type=="unix"):
+		map_file=path.join(build_temp, "multimodule.map") # Shows what each object file added to the linked file
+		map_args.append("-Wl,-Map="+map_file)
+		extra_link_args=extra_link_args+map_args
+	if precompiled_header==True and len(cfiles)>0:
+		tracer.next_phase("precompile header")
+		say_anything("Precompiling the Python headers...")
+		extra_compile_args=extra_compile_args+make_precompiled_header(com, build_temp, extra_compile_args)
+	module_objects={}
+	def compile_and_link(target, args=(), stage=""):
+		# Compiles the C files with args added to the compile and link args, then links them into target.
+		say_anything("Compiling C files using", jobs or os.cpu_count(), "jobs..."+stage)
+		tracer.next_phase("compile"+stage, files=len(cfiles), jobs=jobs or os.cpu_count())
+		objs, failed=compile_c_files(com, cfiles, jobs, macros, tracer, context.threads, extra_postargs=extra_compile_args+list(args), output_dir=build_temp)
+		if len(failed)>0:
+			for cfile, e in failed: eprint("Couldn't compile "+cfile+": "+str(e))
+			die("Couldn't compile the C files to object code")
+		compiled=dict(zip(cfiles, objs))
+		objs=[]
+		for i in mods:
+			if i.name in cached:
+				objs.append(cached[i.name][1])
+				continue
+			objs.append(compiled[i.cfile])
+			if cache_obj is not None: cache_obj.put(i.key, i.cfile, compiled[i.cfile], names.get(i.name, ''))
+		module_objects.update(zip((i.name for i in mods), objs))
+		objs.extend(compiled[i] for i in extra_cfiles)
+		if data_key is not None and len(extra_cfiles)>0: cache_obj.put(data_key, extra_cfiles[0], compiled[extra_cfiles[0]])
+		objs.extend(extra_objs)
+		if target is None: return objs # Linked into the exe instead
+		say_anything("Linking..."+stage)
+		tracer.next_phase("link"+stage, objects=len(objs))
+		try: com.link_shared_object(objs, target, export_symbols=symbols, extra_postargs=extra_link_args+[i for i in args if i.startswith("-fprofile-generate")])
+		except:
+			eprint("Oops, something broke")
+			sys.exit()
+		return objs
+	if not pgo: objs=compile_and_link(None if exe==True else output)
 	else:
-		say_something_important("The temporary directory is at "+build_temp)
+		import shutil
+		profile_dir=path.join(build_temp, "pgo")
+		os.mkdir(profile_dir)
+		stage_output=lambda stage: path.join(build_temp, stage, main_module_name+output_ext) # Named after the main module, so the training script can import it
+		timings={}
+		for stage, args in (("normal", ()), ("instrumented", pgo_instrument_args(com, profile_dir)), ("optimized", None)):
+			if args is None: args=pgo_use_args(com, profile_dir)
+			os.mkdir(path.join(build_temp, stage))
+			objs=compile_and_link(stage_output(stage), args, " ("+stage+")")
+			say_anything("Running the training script with the "+stage+" build...")
+			tracer.next_phase("train ("+stage+")")
+			timings[stage]=run_training(pgo, path.dirname(stage_output(stage)), directory)
+		if exe!=True:
+			os.makedirs(path.dirname(output), exist_ok=True) # copyfile doesn't make missing directories
+			shutil.copyfile(stage_output("optimized"), output)
+		before, after=timings["normal"], timings["optimized"]
+		say_something_important(f"Training script: {before:.3f}s without PGO, {timings['instrumented']:.3f}s instrumented, {after:.3f}s with PGO ({abs(before-after)/before*100:.1f}% {'faster' if after<=before else 'slower'})")
+	if exe==True:
+		# The exe is linked from the same object files as the extension, plus a main function that embeds the interpreter.
+		say_anything("Linking the exe...")
+		tracer.next_phase("link exe", objects=len(objs)+1)
+		exe_source=path.join(build_temp, "multimodule_exe.c")
+		write_exe_main(exe_source, "PyInit_"+main_module_name, main_module_name, exe_main, isolated==True, no_site!=True)
+		libraries, library_dirs, runtime_library_dirs, link_args=get_python_link_args()
+		program=output
+		extension=com.exe_ext if isinstance(com, clang_compiler) else com.exe_extension
+		if extension and program.endswith(extension): program=program[:-len(extension)] # The compiler adds it back
+		try:
+			objs=com.compile([exe_source], output_dir=build_temp, extra_postargs=extra_compile_args)+objs
+			com.link_executable(objs, program, libraries=libraries, library_dirs=library_dirs, runtime_library_dirs=runtime_library_dirs, extra_postargs=link_args+user_link_args+map_args)
+		except Exception as e: die("Couldn't build the exe: "+str(e))
+	if size_report:
+		import json
+		tracer.next_phase("size report")
+		previous=None
+		if path.exists(size_report):
+			try:
+				with open(size_report, "r", encoding="UTF-8") as f: previous=json.load(f)
+			except (OSError, ValueError): eprint("Warning, couldn't read the size report "+size_report+", so it's replaced without showing the changes")
+		if not map_args: eprint("Warning, the linked size of each module is only found when linking with gcc or clang on Linux")
+		report=make_size_report(mods, module_objects, [(i, frozen[i.name]) for i in frozen_mods], main_module_name, output, map_args and map_file)
+		say_something_important(format_size_report(report, previous))
+		with open(size_report, "w", encoding="UTF-8") as f: json.dump(report, f, indent=1, sort_keys=True) # Sorted and indented, so reports can be diffed
+		say_something_interesting("Saved the size report to "+size_report)
+	tracer.next_phase("cleanup")
+	tempdirs.remove(build_temp)
+	if keep_temp==False: clean_temp(build_temp)
+	else: say_something_important("The temporary directory is at "+build_temp)
+	tracer.next_phase()
+	if context is not _shared_build: context.close() # Reaping the Cython workers isn't cleanup work, their CPU time was already added to the cythonize phase
+	if trace:
+		tracer.save(trace)
+		for name, wall, cpu, child_cpu in tracer.summary(): say_something_interesting(f"{name:>25}: {wall:8.3f}s wall, {cpu:8.3f}s CPU, {child_cpu:8.3f}s CPU in child processes")
+		say_something_interesting("Saved the build trace to "+trace)
 	say_something_important("All done! Created "+output)
 	if __name__=="__main__": sys.exit(0)
 
-tempdir=None
+tempdirs=[] # The build_temp of every build that hasn't finished, since a manifest builds several at once.
 if __name__=="__main__":
 	import begin.main
 	app=begin.main.Program(main)
@@ -752,14 +2389,16 @@ if __name__=="__main__":
 		app.start()
 	except:
 		import os, time, sys, os.path as path, traceback
-		if tempdir and path.exists(tempdir):
+		for i in tuple(_open_pools): i.close() # Otherwise the loop below would wait for the Cython worker processes forever
+		if any(path.exists(i) for i in tempdirs):
 			import multiprocessing
 			while len(multiprocessing.active_children())>0:
 				for i in multiprocessing.active_children():
 					if not i.is_alive(): i.close()
 				if len(multiprocessing.active_children())==0: break
 				time.sleep(0.009)
-			clean_temp(tempdir)
+			for i in tempdirs:
+				if path.exists(i): clean_temp(i)
 		type=sys.exc_info()[0]
 		if not type==SystemExit:
 			print(traceback.format_exc())
@@ -0,0 +1,10 @@
+import os, sys, random, tempfile, importlib, traceback
+root=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+import multimodule
+
+# main() imports these as globals, so the functions tested on their own need them as well.
+for name, module in dict(os=os, path=os.path, sys=sys, random=random, tempfile=tempfile, importlib=importlib, traceback=traceback).items(): setattr(multimodule, name, module)
+try: import chardet
+except ImportError: chardet=None
+multimodule.chardet=chardet
@@ -0,0 +1,77 @@
+import os, sys, json, shutil, subprocess, pytest
+from multimodule import build_cache
+from conftest import root
+
+
+def make_cache(tmp_path, *settings):
+	return build_cache(str(tmp_path/"cache"), *(settings or ("3.0", "gcc", ["-O2"])))
+
+def test_key_depends_on_every_part(tmp_path):
+	cache=make_cache(tmp_path)
+	assert cache.key("a", b"x")==cache.key("a", b"x")
+	assert cache.key("a", b"x")!=cache.key("a", b"y")
+	assert cache.key("a", b"x")!=cache.key("b", b"x")
+	assert cache.key("ab", b"c")!=cache.key("a", b"bc") # The parts are length prefixed, so they can't run into each other
+
+def test_key_depends_on_settings(tmp_path):
+	assert make_cache(tmp_path, "3.0", ["-O2"]).key("a")!=make_cache(tmp_path, "3.0", ["-O3"]).key("a")
+	assert make_cache(tmp_path, "3.0", ["-O2"]).key("a")==make_cache(tmp_path, "3.0", ["-O2"]).key("a")
+
+def test_file_key_follows_contents(tmp_path):
+	cache=make_cache(tmp_path)
+	source=tmp_path/"mod.py"
+	source.write_bytes(b"x=1\n")
+	first=cache.file_key("mod", str(source))
+	assert cache.file_key("mod", str(source))==first
+	source.write_bytes(b"x=2\n")
+	assert cache.file_key("mod", str(source))!=first
+
+def test_get_and_put(tmp_path):
+	cache=make_cache(tmp_path)
+	cfile, obj=tmp_path/"mod.c", tmp_path/"mod.o"
+	cfile.write_text("int x;")
+	obj.write_bytes(b"\x7fELF")
+	key=cache.key("mod")
+	assert cache.get(key) is None
+	cache.put(key, str(cfile), str(obj), "PyInit_abc")
+	hit=cache.get(key)
+	assert hit[2]=="PyInit_abc"
+	with open(hit[0]) as f: assert f.read()=="int x;"
+	with open(hit[1], "rb") as f: assert f.read()==b"\x7fELF"
+
+def test_incomplete_entry_is_a_miss(tmp_path):
+	cache=make_cache(tmp_path)
+	key=cache.key("mod")
+	with open(os.path.join(cache.location, key+".c"), "w") as f: f.write("")
+	with open(os.path.join(cache.location, key+".o"), "w") as f: f.write("")
+	assert cache.get(key) is None # The .sym file is written last, so without it the entry isn't finished
+
+def test_dependencies_change_every_key(tmp_path):
+	header=tmp_path/"shared.pxd"
+	header.write_text("cdef int x\n")
+	keys=[]
+	for text in ("cdef int x\n", "cdef long x\n"):
+		header.write_text(text)
+		cache=make_cache(tmp_path)
+		cache.depend_on(str(header))
+		keys.append(cache.key("mod"))
+	assert keys[0]!=keys[1] and make_cache(tmp_path).key("mod") not in keys
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="needs gcc")
+def test_one_edit_only_rebuilds_that_module(tmp_path):
+	pytest.importorskip("Cython")
+	pytest.importorskip("begin")
+	package=tmp_path/"app"
+	package.mkdir()
+	(package/"__init__.py").write_text("from . import helper, other\n")
+	(package/"helper.py").write_text("def f(): return 1\n")
+	(package/"other.py").write_text("def g(): return 2\n")
+	def build(trace):
+		command=[sys.executable, os.path.join(root, "multimodule.py"), "--package", "--no-prompt", "--verbose", "0", "--cache", "cache", "--trace", trace, "app"]
+		result=subprocess.run(command, cwd=tmp_path, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=600)
+		assert result.returncode==0, result.stdout+result.stderr
+		with open(tmp_path/trace) as f: return sorted(i["name"] for i in json.load(f)["traceEvents"] if i["cat"] in ("cythonize", "compile"))
+	assert len(build("first.json"))==6
+	(package/"helper.py").write_text("def f(): return 3\n")
+	# Not the main module, which has every module's PyInit symbol in it.
+	assert build("second.json")==["compile app.helper.c", "cythonize app.helper.py"]
@@ -0,0 +1,25 @@
+import os, sys, subprocess, pytest
+from conftest import root
+
+pytest.importorskip("Cython")
+pytest.importorskip("begin")
+
+
+def test_failed_build_exits(tmp_path):
+	# The worker processes used to keep the crash handler waiting for them forever.
+	(tmp_path/"broken.pyx").write_text("def f(:\n\tpass\n", encoding="UTF-8")
+	(tmp_path/"fine.py").write_text("x=1\n", encoding="UTF-8")
+	command=[sys.executable, os.path.join(root, "multimodule.py"), "--no-prompt", "--verbose", "0", "--build-temp", str(tmp_path/"build"), "fine", "broken"]
+	result=subprocess.run(command, cwd=tmp_path, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=300)
+	assert "Failed to cythonize the code" in result.stdout+result.stderr
+	assert not (tmp_path/"build").exists()
+
+def test_workers_are_spawned():
+	# Forked workers would copy the compiler threads' locks in whatever state they're in.
+	import multimodule
+	pool=multimodule.build_pool(1)
+	try:
+		processes=pool.cython_processes()
+		assert processes._mp_context.get_start_method()=="spawn"
+		assert processes.submit(os.getpid).result(timeout=120)!=os.getpid()
+	finally: pool.close()
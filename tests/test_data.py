@@ -0,0 +1,22 @@
+import os, ctypes, shutil, subprocess, sysconfig, pytest
+from multimodule import write_data_file
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="needs gcc")
+@pytest.mark.parametrize("strings", [True, False])
+def test_data_file(tmp_path, strings):
+	contents=[bytes(range(256))*2+b'"?\\0123??=', b"", b"text\r\n", os.urandom(5000)]
+	files=[]
+	for index, i in enumerate(contents):
+		files.append(str(tmp_path/("file"+str(index))))
+		with open(files[-1], "wb") as f: f.write(i)
+	cfile=str(tmp_path/"data.c")
+	write_data_file(cfile, files, strings)
+	library=str(tmp_path/"data.so")
+	subprocess.run(["gcc", "-shared", "-fPIC", "-Werror", "-I"+sysconfig.get_paths()["include"], cfile, "-o", library], check=True)
+	data=ctypes.CDLL(library)
+	pointers=(ctypes.c_void_p*len(files)).in_dll(data, "multimodule_data")
+	sizes=(ctypes.c_ssize_t*len(files)).in_dll(data, "multimodule_data_sizes")
+	for pointer, size, expected in zip(pointers, sizes, contents):
+		assert size==len(expected) and ctypes.string_at(pointer, size)==expected
+		assert pointer%16==0
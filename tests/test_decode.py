@@ -0,0 +1,29 @@
+import sys, codecs, pytest
+from multimodule import decode_source
+
+
+def test_ascii_and_newlines():
+	assert decode_source(b"x=1\r\ny=2\rz=3\n", "a.py")=="x=1\ny=2\nz=3\n"
+
+def test_bom_and_cookie():
+	assert decode_source(codecs.BOM_UTF8+"x='é'\n".encode("UTF-8"), "a.py", "Latin-1")=="x='é'\n"
+	assert decode_source(b"# -*- coding: Latin-1 -*-\nx='\xe9'\n", "a.py")=="# -*- coding: Latin-1 -*-\nx='é'\n"
+
+def test_explicit_encoding():
+	assert decode_source("x='é'\n".encode("UTF-8"), "a.py", "UTF-8")=="x='é'\n"
+	# Every byte of UTF-16 text can be ASCII, but it mustn't be read as ASCII.
+	assert decode_source("x=1\n".encode("UTF-16-LE"), "a.py", "UTF-16-LE")=="x=1\n"
+
+def test_guessing():
+	assert decode_source("x='é'\n".encode("UTF-8"), "a.py")=="x='é'\n"
+	pytest.importorskip("chardet")
+	assert "x=" in decode_source("x='éèê à la façon française'\n".encode("Latin-1"), "a.py")
+
+def test_guessing_without_chardet(monkeypatch, capsys):
+	monkeypatch.setitem(sys.modules, "chardet", None)
+	with pytest.raises(SystemExit): decode_source(b"x='\xe9'\n", "a.py")
+	assert "chardet isn't installed" in capsys.readouterr().err
+
+def test_unreadable():
+	with pytest.raises(SystemExit): decode_source(b"x='\xff'\n", "a.py", "UTF-8")
+	with pytest.raises(UnicodeDecodeError): decode_source(b"x='\xff'\n", "a.py", "UTF-8", skip_unreadable=True)
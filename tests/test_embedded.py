@@ -0,0 +1,89 @@
+import os, sys, json, shutil, subprocess, pytest
+from conftest import root
+
+pytest.importorskip("Cython")
+pytest.importorskip("begin")
+if shutil.which("gcc") is None: pytest.skip("building an extension needs gcc", allow_module_level=True)
+
+package={
+	"pkg/__init__.py": "VALUE=1\n",
+	"pkg/a.py": "import sys\nfrom . import b\nSELF=sys.modules[__name__]\ndef name(): return __name__\n",
+	"pkg/b.py": "X=2\n",
+	"pkg/sub/__init__.py": "",
+	"pkg/sub/c.py": "Y=3\n",
+}
+
+def build(location, *options, files=None):
+	for name, code in dict(package, **(files or {})).items():
+		os.makedirs(location/os.path.dirname(name), exist_ok=True)
+		(location/name).write_text(code, encoding="UTF-8")
+	command=[sys.executable, os.path.join(root, "multimodule.py"), "--package", "--no-prompt", "--verbose", "0", "--output", str(location/"built"/"pkg.so")]+list(options)+["pkg"]
+	result=subprocess.run(command, cwd=location, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=600)
+	assert result.returncode==0, result.stdout+result.stderr
+	return location/"built"
+
+def run(built, code, env=None):
+	# Imports from the extension in a new interpreter, so each test sees a fresh import system, and returns what the code printed as JSON.
+	result=subprocess.run([sys.executable, "-c", code], cwd=built, capture_output=True, text=True, timeout=120, env=dict(os.environ, **(env or {})))
+	assert result.returncode==0, result.stderr
+	return json.loads(result.stdout)
+
+@pytest.fixture(scope="module")
+def built(tmp_path_factory): return build(tmp_path_factory.mktemp("plain"))
+
+def test_modules_import_from_the_extension(built):
+	results=run(built, "import json, pkg.a, pkg.sub.c\nprint(json.dumps([pkg.VALUE, pkg.a.b.X, pkg.sub.c.Y, pkg.a.name(), pkg.a.__file__==pkg.__file__, type(pkg.a.name).__name__]))")
+	assert results[:5]==[1, 2, 3, "pkg.a", True]
+	assert results[5]!="function" # Compiled by Cython, not run from source
+
+def test_module_is_the_one_being_executed(built):
+	# create_module makes the module object and exec_module fills it in, so the module sees itself in sys.modules while it runs.
+	assert run(built, "import json, sys, pkg.a\nprint(json.dumps([pkg.a.SELF is pkg.a, sys.modules['pkg.a'] is pkg.a, pkg.a.__spec__.name]))")==[True, True, "pkg.a"]
+
+def test_unknown_modules(built):
+	assert run(built, "import json, pkg\ntry: import pkg.missing\nexcept ModuleNotFoundError as e: print(json.dumps(e.name))")=="pkg.missing"
+
+@pytest.mark.skipif(shutil.which("nm") is None, reason="needs nm")
+def test_only_the_main_module_is_exported(built):
+	# The other PyInit functions are called through the table in the main module.
+	symbols=subprocess.run(["nm", "-D", "--defined-only", str(built/"pkg.so")], capture_output=True, text=True, check=True).stdout
+	assert [i.split()[-1] for i in symbols.splitlines() if "PyInit_" in i]==["PyInit_pkg"]
+
+@pytest.fixture(scope="module")
+def lazy(tmp_path_factory): return build(tmp_path_factory.mktemp("lazy"), "--lazy-import")
+
+def test_lazy_attributes(lazy):
+	code="import json, sys, pkg\nbefore='pkg.sub.c' in sys.modules\nprint(json.dumps([before, pkg.sub.c.Y, 'pkg.sub.c' in sys.modules, 'c' in dir(pkg.sub), 'a' in dir(pkg)]))"
+	assert run(lazy, code)==[False, 3, True, True, True]
+
+def test_lazy_attribute_errors(lazy):
+	assert run(lazy, "import json, pkg\ntry: pkg.missing\nexcept AttributeError as e: print(json.dumps(str(e)))").endswith("'missing'")
+
+def test_no_lazy_attributes_without_the_option(built):
+	assert run(built, "import json, pkg\nprint(json.dumps(hasattr(pkg, 'sub')))")==False
+
+def test_import_profile(tmp_path_factory):
+	profiled=build(tmp_path_factory.mktemp("profiled"), "--import-profile")
+	times, report=run(profiled, "import json, pkg, pkg.a\nprint(json.dumps([pkg.import_times(), pkg.import_report()]))")
+	assert {"pkg.a", "pkg.b"}<=set(times)
+	assert set(times["pkg.a"])>={"find_spec", "exec", "self", "count", "depth"}
+	assert times["pkg.b"]["depth"]>times["pkg.a"]["depth"] # Imported by pkg.a
+	assert report.splitlines()[0].startswith("import time:") and "pkg.a" in report
+
+def test_importtime_environment_variable(built, tmp_path):
+	assert run(built, "import json, pkg\nprint(json.dumps(pkg.import_times()))")=={}
+	destination=tmp_path/"times.json"
+	run(built, "import json, pkg.a\nprint(json.dumps(None))", dict(MULTIMODULE_IMPORTTIME=str(destination)))
+	with open(destination) as f: assert "pkg.a" in json.load(f)
+
+def test_protect_function_with_frozen_modules(tmp_path):
+	# The protect function's check used to turn away every module that wasn't compiled.
+	protected=build(tmp_path, "--freeze", "pkg.a", "--protect-function", "allow", files={"pkg/__init__.py": "VALUE=1\ndef allow(name): return name!='pkg.sub.c'\n"})
+	code="import json, pkg.a\ntry: import pkg.sub.c\nexcept ImportError: blocked=True\nelse: blocked=False\nprint(json.dumps([pkg.a.b.X, type(pkg.a.name).__name__, blocked]))"
+	assert run(protected, code)==[2, "function", True] # pkg.a is bytecode
+
+def test_preload_leaves_out_main(tmp_path):
+	# Importing a __main__ module runs the program.
+	preloading=build(tmp_path, "--preload", files={"pkg/__main__.py": "import builtins\nbuiltins.MAIN_RAN=True\n"})
+	code="import json, builtins, pkg\nall, named=pkg.preload(background=False), pkg.preload('pkg', background=False)\nran=hasattr(builtins, 'MAIN_RAN')\nprint(json.dumps([sorted(all.loaded), sorted(named.loaded), all.failed=={}, ran, pkg.preload('pkg.__main__', background=False).loaded, hasattr(builtins, 'MAIN_RAN')]))"
+	assert run(preloading, code)==[["pkg.a", "pkg.b", "pkg.sub", "pkg.sub.c"]]*2+[True, False, ["pkg.__main__"], True]
@@ -0,0 +1,10 @@
+import shutil, subprocess, sysconfig, pytest
+from multimodule import write_exe_main
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="needs gcc")
+@pytest.mark.parametrize("run_main", [None, "app", "app.__main__"])
+def test_exe_main_compiles_without_warnings(tmp_path, run_main):
+	source=str(tmp_path/"main.c")
+	write_exe_main(source, "PyInit_app", "app", run_main)
+	subprocess.run(["gcc", "-c", "-Wall", "-Werror", "-I"+sysconfig.get_paths()["include"], source, "-o", str(tmp_path/"main.o")], check=True)
@@ -0,0 +1,63 @@
+import os, importlib.machinery, pytest
+import multimodule
+from multimodule import file_index, get_name, locate_modules
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+	for name in ("pkg/__init__.py", "pkg/mod.py", "pkg/sub/__init__.py", "pkg/sub/leaf.pyx", "pkg/data/table.txt", "plain/script.py", "top.py"):
+		(tmp_path/name).parent.mkdir(parents=True, exist_ok=True)
+		(tmp_path/name).write_text("")
+	# main sets these up, and they're remembered between calls.
+	monkeypatch.setattr(multimodule, "ext", tuple(importlib.machinery.all_suffixes())+(".pyx",), raising=False)
+	for i in (multimodule._file_index, multimodule._cached_names, multimodule._located_modules): i.clear()
+	yield tmp_path
+	for i in (multimodule._file_index, multimodule._cached_names, multimodule._located_modules): i.clear()
+
+def test_scan(tree):
+	index=file_index()
+	files, dirs=index.scan(str(tree/"pkg"))
+	assert sorted(files)==["__init__.py", "mod.py"] and sorted(dirs)==["data", "sub"]
+	assert index.isfile(str(tree/"pkg"/"mod.py")) and not index.isfile(str(tree/"pkg"/"sub"))
+	assert index.isdir(str(tree/"pkg"/"sub")) and not index.isdir(str(tree/"pkg"/"mod.py")) and not index.isdir(str(tree/"missing"))
+
+def test_each_directory_is_scanned_once(tree, monkeypatch):
+	scanned=[]
+	scandir=os.scandir
+	def counting(location):
+		scanned.append(location)
+		return scandir(location)
+	monkeypatch.setattr(os, "scandir", counting)
+	index=file_index()
+	for i in range(3): index.isfile(str(tree/"pkg"/"mod.py"))
+	assert len(scanned)==1
+	# The parent was scanned and doesn't have it, so it isn't scanned at all.
+	index.scan(str(tree))
+	assert index.scan(str(tree/"missing"))==({}, {}) and len(scanned)==2
+	# Until the index is cleared, new files aren't noticed.
+	(tree/"pkg"/"new.py").write_text("")
+	assert not index.isfile(str(tree/"pkg"/"new.py"))
+	index.clear()
+	assert index.isfile(str(tree/"pkg"/"new.py"))
+
+def test_case_is_normalized(tree, monkeypatch):
+	monkeypatch.setattr(os.path, "normcase", lambda i: i.lower()) # Like Windows
+	index=file_index()
+	assert index.isfile(str(tree/"pkg"/"MOD.PY")) and index.isdir(str(tree/"PKG"/"Sub"))
+	assert index.scan(str(tree/"pkg"))[0]["mod.py"]=="mod.py" # The real name is kept
+
+def test_find_files(tree):
+	found=file_index().find_files(str(tree/"pkg"), (".py", ".pyx"))
+	assert [os.path.relpath(i, tree) for i in found]==[os.path.join("pkg", "__init__.py"), os.path.join("pkg", "mod.py"), os.path.join("pkg", "sub", "__init__.py"), os.path.join("pkg", "sub", "leaf.pyx")]
+
+def test_get_name(tree):
+	assert get_name(str(tree/"pkg"/"sub"/"leaf.pyx"))=="pkg.sub.leaf"
+	assert get_name(str(tree/"pkg"/"__init__.py"))=="pkg.__init__"
+	assert get_name(str(tree/"plain"/"script.py"))=="script" # No __init__ file, so not a package
+
+def test_locate_modules(tree):
+	assert locate_modules("top", directory=str(tree))==[str(tree/"top.py")]
+	assert locate_modules("pkg.mod", directory=str(tree))==[str(tree/"pkg"/"mod.py")]
+	assert locate_modules("pkg.sub.leaf", directory=str(tree))==[str(tree/"pkg"/"sub"/"leaf.pyx")]
+	assert sorted(locate_modules("pkg", directory=str(tree)))==sorted(str(tree/i) for i in ("pkg/__init__.py", "pkg/mod.py", "pkg/sub/__init__.py", "pkg/sub/leaf.pyx"))
+	with pytest.raises(SystemExit): locate_modules("missing", directory=str(tree))
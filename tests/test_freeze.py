@@ -0,0 +1,28 @@
+import os, marshal, pytest
+from multimodule import mod, choose_frozen_modules
+
+
+@pytest.fixture
+def modules(tmp_path):
+	sources={"small.py": "X=1\n", "big.py": "X=1\n"*100, "hot.py": "X=1\n", "fast.pyx": "X=1\n", "typed.py": "X=1\n", "typed.pxd": "cdef int X\n"}
+	for name, code in sources.items(): (tmp_path/name).write_text(code)
+	return [mod(name=i[:-3] if i.endswith(".py") else i[:-4], shortname=os.path.splitext(i)[0], file=str(tmp_path/i)) for i in sources if not i.endswith(".pxd")]
+
+def names(results): return sorted(i.name for i in results)
+
+def test_named(modules, capsys):
+	assert names(choose_frozen_modules(modules, "big,fast,typed,missing"))==["big"]
+	warnings=capsys.readouterr().err
+	assert "fast needs Cython" in warnings and "typed needs Cython" in warnings and "aren't included: missing" in warnings
+
+def test_size(modules):
+	assert names(choose_frozen_modules(modules, size=100))==["hot", "small"] # Never .pyx files or modules with a .pxd file
+	assert choose_frozen_modules(modules)==[]
+
+def test_profile(modules, tmp_path):
+	# The format pstats reads: (file, line, function) mapped to the call counts, times and callers.
+	stats={(str(tmp_path/"hot.py"), 1, "f"): (1, 1, 0.99, 0.99, {}), (str(tmp_path/"big.py"), 1, "g"): (1, 1, 0.005, 0.005, {}), ("~", 0, "<built-in method builtins.exec>"): (1, 1, 0.005, 1.0, {})}
+	with open(tmp_path/"profile", "wb") as f: marshal.dump(stats, f)
+	assert names(choose_frozen_modules(modules, profile=str(tmp_path/"profile")))==["big", "small"]
+	assert names(choose_frozen_modules(modules, profile=str(tmp_path/"profile"), threshold=0.001))==["small"]
+	assert names(choose_frozen_modules(modules, "hot", profile=str(tmp_path/"profile")))==["big", "hot", "small"] # Named modules are frozen anyway
@@ -0,0 +1,11 @@
+import os, sys, subprocess, pytest
+from conftest import root
+
+pytest.importorskip("begin")
+
+
+def test_help():
+	# argparse formats the help with %, so an option description with a % sign in it broke --help.
+	result=subprocess.run([sys.executable, os.path.join(root, "multimodule.py"), "--help"], capture_output=True, text=True, timeout=120)
+	assert result.returncode==0, result.stderr
+	assert "--freeze-profile" in result.stdout and "--manifest" in result.stdout
@@ -0,0 +1,66 @@
+from multimodule import mod, find_imports, find_used_modules, get_import_order
+
+
+def write_module(tmp_path, name, code, package=False):
+	parts=name.split(".")
+	location=tmp_path.joinpath(*parts[:-1], parts[-1]) if package else tmp_path.joinpath(*parts[:-1])
+	location.mkdir(parents=True, exist_ok=True)
+	filename=location/("__init__.py" if package else parts[-1]+".py")
+	filename.write_text(code, encoding="UTF-8")
+	return mod(name=name, shortname=parts[-1], file=str(filename))
+
+def test_absolute_and_relative_imports(tmp_path):
+	module=write_module(tmp_path, "pkg.sub.mod", "import os.path\nfrom . import sibling\nfrom ..other import thing\nfrom .. import *\n")
+	found=find_imports(module)
+	assert {"os", "os.path", "pkg.sub", "pkg.sub.sibling", "pkg.other", "pkg.other.thing", "pkg"}<=found
+	assert not any(i.endswith("*") for i in found)
+
+def test_relative_imports_in_a_package(tmp_path):
+	module=write_module(tmp_path, "pkg", "from .helper import name\n", package=True)
+	assert {"pkg.helper", "pkg.helper.name"}<=find_imports(module)
+
+def test_import_module_calls(tmp_path):
+	module=write_module(tmp_path, "pkg.mod", "import importlib\nplugin=importlib.import_module('pkg.plugin')\nother=__import__('json')\n")
+	assert {"pkg.plugin", "json"}<=find_imports(module)
+
+def test_cython_code(tmp_path):
+	# ast can't parse Cython, so the import statements are found line by line.
+	module=write_module(tmp_path, "pkg.fast", "cimport cython\nfrom pkg.util import (\n\ta,\n\tb)\ncdef int x=1\n")
+	assert {"cython", "pkg.util", "pkg.util.a", "pkg.util.b"}<=find_imports(module)
+
+def test_results_are_cached_on_disk(tmp_path):
+	module=write_module(tmp_path, "pkg.mod", "import json\n")
+	cache=tmp_path/"cache"
+	cache.mkdir()
+	assert "json" in find_imports(module, cache_dir=str(cache))
+	assert len(list(cache.glob("*.imports")))==1
+
+def test_find_used_modules(tmp_path):
+	main=write_module(tmp_path, "pkg", "from pkg import a\n", package=True)
+	a=write_module(tmp_path, "pkg.a", "import pkg.b\n")
+	b=write_module(tmp_path, "pkg.b", "x=1\n")
+	unused=write_module(tmp_path, "pkg.unused", "import pkg.a\n")
+	assert find_used_modules(main, [a, b, unused])=={"pkg", "pkg.a", "pkg.b"}
+
+def test_import_order(tmp_path):
+	main=write_module(tmp_path, "pkg", "x=1\n", package=True)
+	sub=write_module(tmp_path, "pkg.sub", "", package=True)
+	a=write_module(tmp_path, "pkg.a", "from pkg.sub import leaf\nimport pkg.b\n")
+	b=write_module(tmp_path, "pkg.b", "import json\n")
+	leaf=write_module(tmp_path, "pkg.sub.leaf", "from .. import b\n")
+	order=get_import_order([a, b, sub, leaf], main)
+	assert sorted(order)==["pkg.a", "pkg.b", "pkg.sub", "pkg.sub.leaf"]
+	assert order.index("pkg.sub")<order.index("pkg.sub.leaf")<order.index("pkg.a")
+	assert order.index("pkg.b")<order.index("pkg.sub.leaf")
+
+def test_import_order_with_a_cycle(tmp_path):
+	main=write_module(tmp_path, "pkg", "", package=True)
+	modules=[write_module(tmp_path, "pkg.a", "import pkg.b\n"), write_module(tmp_path, "pkg.b", "import pkg.a\n"), write_module(tmp_path, "pkg.c", "import pkg.a\n")]
+	order=get_import_order(modules, main)
+	assert sorted(order)==["pkg.a", "pkg.b", "pkg.c"] and order[-1]=="pkg.c"
+
+def test_import_order_of_a_long_chain(tmp_path):
+	# Deeper than the recursion limit.
+	main=write_module(tmp_path, "pkg", "", package=True)
+	modules=[write_module(tmp_path, "pkg.m"+str(i), "import pkg.m"+str(i+1)+"\n" if i<1999 else "") for i in range(2000)]
+	assert get_import_order(modules, main)==["pkg.m"+str(i) for i in range(1999, -1, -1)]
@@ -0,0 +1,32 @@
+import pytest
+from multimodule import load_manifest
+
+
+def write(tmp_path, name, text):
+	filename=tmp_path/name
+	filename.write_text(text, encoding="UTF-8")
+	return str(filename)
+
+def test_json(tmp_path):
+	shared, targets=load_manifest(write(tmp_path, "build.json", '{"options": {"package": true}, "targets": {"app": {"main_module": "app", "directory": "src", "files": ["extra"]}}}'))
+	assert shared=={"package": True}
+	assert targets=={"app": {"main_module": "app", "directory": "src", "files": ["extra"]}}
+
+def test_toml(tmp_path):
+	pytest.importorskip("tomllib")
+	shared, targets=load_manifest(write(tmp_path, "build.toml", 'options={jobs=2}\n[targets.one]\nmain_module="one"\n[targets.two]\nmain_module="two"\noutput="two.so"\n'))
+	assert shared=={"jobs": 2} and list(targets)==["one", "two"]
+
+def test_shared_main_module(tmp_path):
+	shared, targets=load_manifest(write(tmp_path, "build.json", '{"options": {"main_module": "app"}, "targets": {"debug": {}, "release": {}}}'))
+	assert list(targets)==["debug", "release"]
+
+@pytest.mark.parametrize("text", [
+	'{"targets": {}}',
+	'{"targets": {"app": {"main_module": "app", "no_such_option": 1}}}',
+	'{"targets": {"app": {"output": "app.so"}}}',
+	'{"targets": {"app": "app"}}',
+	'{"targets": ',
+])
+def test_bad_manifests(tmp_path, text):
+	with pytest.raises(SystemExit): load_manifest(write(tmp_path, "build.json", text))
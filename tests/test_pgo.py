@@ -0,0 +1,18 @@
+import os, sys, shutil, subprocess, pytest
+from conftest import root
+
+pytest.importorskip("Cython")
+pytest.importorskip("begin")
+if shutil.which("gcc") is None: pytest.skip("PGO builds need gcc", allow_module_level=True)
+
+
+def test_output_in_a_new_directory(tmp_path):
+	(tmp_path/"app.py").write_text("def total(n):\n\treturn sum(i*i for i in range(n))\n", encoding="UTF-8")
+	(tmp_path/"train.py").write_text("import app\napp.total(1000)\n", encoding="UTF-8")
+	output=tmp_path/"dist"/"lib"/"app.so"
+	command=[sys.executable, os.path.join(root, "multimodule.py"), "--no-prompt", "--verbose", "0", "--pgo", "train.py", "--cache", "cache", "--output", str(output), "app"]
+	result=subprocess.run(command, cwd=tmp_path, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=600)
+	assert result.returncode==0 and output.exists(), result.stdout+result.stderr
+	# The cache key doesn't have the PGO flags in it, so the objects mustn't be cached.
+	assert "the cache isn't used for PGO builds" in result.stderr
+	assert not (tmp_path/"cache").exists() or not any((tmp_path/"cache").iterdir())
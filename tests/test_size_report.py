@@ -0,0 +1,100 @@
+from multimodule import mod, read_link_map, count_generated_code, make_size_report, format_size_report
+
+c_code="""static PyObject *utility(PyObject *x) {
+  PyObject *__pyx_t_9 = NULL;
+  return PyNumber_Negative(x);
+}
+/* #### Code section: module_code ### */
+static PyObject *__pyx_pf_f(PyObject *x) {
+  PyObject *__pyx_t_1 = NULL;
+  int __pyx_t_2;
+  Py_ssize_t __pyx_t_3;
+  __pyx_t_1 = PyNumber_Add(x, x); if (unlikely(!__pyx_t_1)) return NULL;
+  __Pyx_DECREF(__pyx_t_1);
+  return __pyx_t_1;
+}
+/* #### Code section: pystring_table ### */
+static int strings(void) { return PyUnicode_InternFromString("x")!=NULL; }
+"""
+
+def write_gnu_map(tmp_path, a, b):
+	filename=tmp_path/"gnu.map"
+	filename.write_text("""Discarded input sections
+
+ .text          0x0000000000000000       0x99 %(a)s
+
+Linker script and memory map
+
+ .text          0x0000000000001000      0x120 %(a)s
+ .text.a_function_with_a_long_name
+                0x0000000000001120       0x40 %(a)s
+ .rodata        0x0000000000002000       0x10 %(b)s
+ .data          0x0000000000003000        0x0 %(b)s
+ .bss           0x0000000000004000        0x8 %(a)s
+ .debug_info    0x0000000000000000       0x30 %(a)s
+ .eh_frame      0x0000000000005000       0x18 %(b)s
+""" % dict(a=a, b=b))
+	return str(filename)
+
+def test_gnu_map(tmp_path):
+	a, b=str(tmp_path/"a.o"), str(tmp_path/"b.o")
+	sizes=read_link_map(write_gnu_map(tmp_path, a, b))
+	assert sizes=={a: {"text": 0x160, "bss": 8, "debug": 0x30}, b: {"rodata": 0x28}}
+
+def test_lld_map(tmp_path):
+	a, b=str(tmp_path/"a.o"), str(tmp_path/"b.o")
+	filename=tmp_path/"lld.map"
+	filename.write_text("""             VMA              LMA     Size Align Out     In      Symbol
+             1000             1000      100    16 .text
+             1000             1000       80    16         %(a)s:(.text)
+             1080             1080       20     1         %(b)s:(.text.f)
+             1080             1080       20     1                 f
+             2000             2000       10     1         %(a)s:(.rodata.str1.1)
+             3000             3000        4     4         %(b)s:(.got)
+""" % dict(a=a, b=b))
+	assert read_link_map(str(filename))=={a: {"text": 0x80, "rodata": 0x10}, b: {"text": 0x20, "data": 4}}
+
+def test_count_generated_code(tmp_path):
+	cfile=tmp_path/"mod.c"
+	cfile.write_text(c_code)
+	# Only the module's own code counts, not the utility code or the string table.
+	assert count_generated_code(str(cfile))==dict(python_api_calls=2, object_temps=1, c_temps=2)
+
+def write_module(tmp_path, name, lines, c=None, obj=None):
+	source=tmp_path/(name+".py")
+	source.write_text("x=1\n"*lines)
+	module=mod(name=name, shortname=name.rpartition(".")[2], file=str(source))
+	if c is not None:
+		module.cfile=str(tmp_path/(name+".c"))
+		(tmp_path/(name+".c")).write_text(c)
+	if obj is not None: (tmp_path/(name+".o")).write_bytes(b"\0"*obj)
+	return module
+
+def test_size_report(tmp_path):
+	main=write_module(tmp_path, "app", 1, c_code, 100)
+	small=write_module(tmp_path, "app.small", 2, c_code, 200)
+	big=write_module(tmp_path, "app.big", 3, c_code, 50)
+	cold=write_module(tmp_path, "app.cold", 4)
+	output=tmp_path/"app.so"
+	output.write_bytes(b"\0"*1000)
+	objects={i.name: str(tmp_path/(i.name+".o")) for i in (main, small, big)}
+	map_file=write_gnu_map(tmp_path, objects["app.big"], objects["app.small"])
+	report=make_size_report([main, small, big], objects, [(cold, b"x"*70)], "app", str(output), map_file)
+	assert report["output_bytes"]==1000
+	rows={i["name"]: i for i in report["modules"]}
+	# Linked sizes leave out bss and debug info, and modules the map doesn't list fall back to their object file.
+	assert rows["app.big"]["linked_bytes"]==0x160 and rows["app.small"]["linked_bytes"]==0x28 and rows["app"]["linked_bytes"] is None
+	assert rows["app"]["kind"]=="main" and rows["app.cold"]["kind"]=="frozen" and rows["app.cold"]["bytecode_bytes"]==70
+	assert rows["app.big"]["source_lines"]==3 and rows["app.big"]["python_api_calls"]==2
+	assert [i["name"] for i in report["modules"]]==["app.big", "app", "app.cold", "app.small"]
+
+def test_format_size_report():
+	row=dict(kind="cython", source_lines=1, c_bytes=10, object_bytes=20, linked_bytes=None, python_api_calls=1, object_temps=0, c_temps=0)
+	report=dict(output="app.so", output_bytes=500, modules=[dict(row, name="app.a", object_bytes=30), dict(row, name="app.new")])
+	previous=dict(output="app.so", output_bytes=450, modules=[dict(row, name="app.a"), dict(row, name="app.gone")])
+	lines=format_size_report(report, previous).splitlines()
+	assert lines[0].split()[:2]==["module", "kind"] and lines[0].split()[-1]=="change"
+	assert lines[1].split()[0]=="app.a" and lines[1].split()[-1]=="+10"
+	assert lines[2].split()[-1]=="new" and lines[3].split()[0]=="app.gone" and lines[3].split()[-1]=="removed"
+	assert lines[-1]=="app.so: 500 bytes (+50)"
+	assert not "change" in format_size_report(report)
@@ -0,0 +1,23 @@
+import os, sys, subprocess
+from multimodule import get_stable_symbol
+from conftest import root
+
+
+def test_symbol_is_a_c_name():
+	symbol=get_stable_symbol("package.module")
+	assert symbol.startswith("PyInit_") and symbol.isidentifier()
+	assert len(symbol)==len("PyInit_")+8
+	assert len(get_stable_symbol("package.module", 16))==len("PyInit_")+16
+
+def test_symbols_differ_between_modules():
+	names=["a", "b", "a.b", "a_b", "package.module", "package.module2"]
+	assert len(set(get_stable_symbol(i) for i in names))==len(names)
+
+def test_symbol_is_the_same_in_every_process():
+	# The symbol can't depend on str hashing, which changes between processes.
+	code="import sys; sys.path.insert(0, sys.argv[1]); import multimodule; print(multimodule.get_stable_symbol('package.module'))"
+	results=set()
+	for seed in ("1", "2"):
+		result=subprocess.run([sys.executable, "-c", code, root], capture_output=True, text=True, env=dict(os.environ, PYTHONHASHSEED=seed), check=True)
+		results.add(result.stdout.strip())
+	assert results=={get_stable_symbol("package.module")}
@@ -0,0 +1,48 @@
+import os, sys, json, shutil, subprocess, pytest
+from multimodule import build_trace
+from conftest import root
+
+
+def test_phases_and_files(tmp_path):
+	trace=build_trace()
+	trace.next_phase("compile", files=1)
+	with trace.phase("compile a.c", "compile", file="a.c"): pass
+	trace.next_phase()
+	events={i["name"]: i for i in trace.events}
+	assert events["compile"]["cat"]=="phase" and events["compile"]["args"]["files"]==1
+	assert "cpu_ms" in events["compile"]["args"] and "child_cpu_ms" in events["compile"]["args"]
+	# Files are compiled at the same time, so process wide CPU times would include the other files.
+	assert not "cpu_ms" in events["compile a.c"]["args"] and not "child_cpu_ms" in events["compile a.c"]["args"]
+	assert [i[0] for i in trace.summary()]==["compile"]
+	trace.save(str(tmp_path/"trace.json"))
+	with open(tmp_path/"trace.json") as f: saved=json.load(f)
+	assert sorted(i["name"] for i in saved["traceEvents"])==["compile", "compile a.c"]
+
+def test_worker_times_are_kept():
+	trace=build_trace()
+	trace.add("cythonize a.py", "cythonize", trace.start, 0.5, 0.25)
+	assert trace.events[0]["args"]=={"cpu_ms": 250.0} and trace.events[0]["dur"]==500000
+
+def test_worker_cpu_goes_to_the_phase():
+	trace=build_trace()
+	trace.next_phase("cythonize")
+	trace.add_child_cpu(0.25)
+	trace.add_child_cpu(0.5)
+	trace.next_phase()
+	assert trace.summary()[0][3]>=0.75
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="needs gcc")
+def test_build_books_cython_workers_to_cythonize(tmp_path):
+	pytest.importorskip("Cython")
+	pytest.importorskip("begin")
+	(tmp_path/"app.py").write_text("print(1)\n")
+	(tmp_path/"helper.py").write_text("def f(): return 1\n")
+	command=[sys.executable, os.path.join(root, "multimodule.py"), "--no-prompt", "--verbose", "0", "--trace", "trace.json", "app", "helper"]
+	result=subprocess.run(command, cwd=tmp_path, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=600)
+	assert result.returncode==0, result.stdout+result.stderr
+	with open(tmp_path/"trace.json") as f: events=json.load(f)["traceEvents"]
+	phases={i["name"]: i["args"] for i in events if i["cat"]=="phase"}
+	jobs=sum(i["args"]["cpu_ms"] for i in events if i["cat"]=="cythonize")
+	# The workers are only waited for when the pool is closed, which used to put their time in cleanup.
+	assert jobs>0 and phases["cythonize"]["child_cpu_ms"]>=jobs
+	assert phases["cleanup"]["child_cpu_ms"]<jobs
@@ -0,0 +1,68 @@
+import io, pytest
+from multimodule import mod, get_string_rows, write_unity_modules
+
+
+def write_module(tmp_path, name, code, package=False, pxd=False):
+	parts=name.split(".")
+	location=tmp_path.joinpath(*parts) if package else tmp_path.joinpath(*parts[:-1])
+	location.mkdir(parents=True, exist_ok=True)
+	filename=location/("__init__.py" if package else parts[-1]+".py")
+	filename.write_text(code, encoding="UTF-8")
+	if pxd: filename.with_suffix(".pxd").write_text("cdef int x\n", encoding="UTF-8")
+	return mod(name=name, shortname=parts[-1], file=str(filename))
+
+def unity(*modules):
+	p=io.StringIO()
+	write_unity_modules(p, modules, "UTF-8")
+	return p.getvalue()
+
+def test_string_rows():
+	lines=['x=1\n', 'y=f"""a\n', '{x}\n', 'b"""\n', 'z="""c\n', 'd"""\n', 'single="e"\n']
+	# Only the lines after the first line of a string are inside it. f-strings are tokenized differently from Python 3.12.
+	assert get_string_rows(lines)=={2, 3, 5}
+	assert get_string_rows(['x="""\n'])==None
+
+def test_functions(tmp_path):
+	code=unity(write_module(tmp_path, "app.a", "x=1\ndef f():\n    return x\n"), write_module(tmp_path, "app.b", "y=2\n"))
+	assert "def multimodule_module_0(__name__, __file__, __package__, __spec__, __loader__):\n x=1\n def f():\n     return x\n pass\n return locals()\n" in code
+	assert "def multimodule_module_1(" in code and " y=2\n" in code
+	assert "cdef tuple multimodule_functions=(multimodule_module_0, multimodule_module_1, )\n" in code
+
+def test_strings_keep_their_lines(tmp_path):
+	code=unity(write_module(tmp_path, "app.a", 'x=1\ntext="""first\nsecond\n"""\nformatted=f"""{x}\nthird"""\n'))
+	assert ' text="""first\nsecond\n"""\n' in code
+	assert ' formatted=f"""{x}\nthird"""\n' in code
+
+def test_relative_imports(tmp_path):
+	code=unity(write_module(tmp_path, "app.sub.mod", "from . import sibling\nfrom ..other import thing\nfrom .sibling cimport fast\n"))
+	assert " from app.sub import sibling\n" in code and " from app.other import thing\n" in code
+	# The cimport is moved to the top, after being made absolute.
+	assert code.startswith("from app.sub.sibling cimport fast\n")
+
+def test_relative_imports_in_a_package(tmp_path):
+	assert " from app.pkg.helper import name\n" in unity(write_module(tmp_path, "app.pkg", "from .helper import name\n", package=True))
+
+def test_cimports_are_moved_out(tmp_path):
+	code=unity(write_module(tmp_path, "app.a", "cimport cython\nfrom libc.math cimport sqrt\nx=sqrt(4)\n"))
+	assert code.startswith("cimport cython\nfrom libc.math cimport sqrt\ndef multimodule_module_0(")
+	assert not " cimport" in code.split("def multimodule_module_0")[1]
+
+@pytest.mark.parametrize("code, problem", [
+	("cdef class Thing:\n\tpass\n", "C level functions and types"),
+	("cdef int add(int a):\n\treturn a\n", "C level functions and types"),
+	("cpdef f(): pass\n", "C level functions and types"),
+	("def f():\n\tglobal x\n\tx=1\nglobal y\n", "global would refer to the main module"),
+	("from os import *\n", "import * isn't allowed"),
+	("from ... import far\n", "goes outside of the top level package"),
+])
+def test_unsupported_code(tmp_path, capsys, code, problem):
+	with pytest.raises(SystemExit): unity(write_module(tmp_path, "app.a", code))
+	assert problem in capsys.readouterr().err
+
+def test_pxd_files_are_unsupported(tmp_path, capsys):
+	with pytest.raises(SystemExit): unity(write_module(tmp_path, "app.a", "x=1\n", pxd=True))
+	assert "it has a .pxd file" in capsys.readouterr().err
+
+def test_indented_cdef_is_left_alone(tmp_path):
+	# Only top level code becomes part of the function's body.
+	assert " def f():\n     cdef int i=0\n" in unity(write_module(tmp_path, "app.a", "def f():\n    cdef int i=0\n"))
@@ -0,0 +1,21 @@
+import time
+import multimodule
+
+
+def test_watch_keeps_going_after_an_exception(tmp_path, monkeypatch, capsys):
+	source=tmp_path/"mod.py"
+	source.write_text("x=1\n")
+	calls=[]
+	def failing_main(*args, **kwargs):
+		calls.append(kwargs)
+		raise OSError("the disk is full")
+	def stop(seconds): raise KeyboardInterrupt # The second time around nothing changed, so it sleeps
+	monkeypatch.setattr(multimodule, "main", failing_main)
+	monkeypatch.setattr(multimodule, "get_watched_files", lambda *args, **kwargs: [str(source)])
+	monkeypatch.setattr(time, "sleep", stop)
+	options=dict(main_module="mod", files=(), cache=str(tmp_path/"cache"), package=False, init_code=None, data="", directory="")
+	multimodule.watch_build(options)
+	assert len(calls)==1
+	assert calls[0]["stable_names"]==True and calls[0]["cache"] # So a changed module doesn't change the main module as well
+	err=capsys.readouterr().err
+	assert "OSError: the disk is full" in err and "The build failed." in err